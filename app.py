@@ -5,9 +5,10 @@ from datetime import datetime
 import pytz
 import os
 import spotipy
+from concurrent.futures import ThreadPoolExecutor
 
 # Import from the new 'core' directory
-from core import calendar_utils, gamification_utils, audio_utils, spotify_utils
+from core import calendar_utils, gamification_utils, audio_utils, spotify_utils, user_store
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="FocusFlow - Main", page_icon="🤖", layout="wide", initial_sidebar_state="expanded")
@@ -25,6 +26,11 @@ def initialize_app_state():
 
 initialize_app_state()
 
+@st.cache_resource
+def get_user_store():
+    """Opens the shared user store once per Streamlit server process."""
+    return user_store.open_user_store()
+
 # --- ONBOARDING WIDGET ---
 if st.session_state.user_profile is None:
     st.title("Welcome to FocusFlow V2! 🚀")
@@ -38,6 +44,8 @@ if st.session_state.user_profile is None:
         submitted = st.form_submit_button("Save Profile")
         if submitted and name and telegram_id:
             st.session_state.user_profile = {"name": name, "timezone": user_timezone, "telegram_id": telegram_id}
+            # Register with the shared user store so the Telegram agent recognizes this chat without a restart.
+            get_user_store().upsert_user(telegram_id, name, user_timezone, f"tokens/token_{telegram_id}.json", telegram_id=telegram_id)
             st.rerun()
     st.stop()
 
@@ -109,12 +117,13 @@ if st.session_state.calendar_service and st.session_state.spotify_client:
         try:
             genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
             add_event_tool = genai.protos.FunctionDeclaration(name="add_event", description="Adds an event to the calendar.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"summary": genai.protos.Schema(type=genai.protos.Type.STRING), "start_time_str": genai.protos.Schema(type=genai.protos.Type.STRING), "end_time_str": genai.protos.Schema(type=genai.protos.Type.STRING), "description": genai.protos.Schema(type=genai.protos.Type.STRING)}, required=["summary", "start_time_str", "end_time_str"]))
-            get_events_tool = genai.protos.FunctionDeclaration(name="get_events", description="Fetches events for a specific date.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="The date in YYYY-MM-DD format. If omitted, today's date will be used.")}))
-            tools = genai.protos.Tool(function_declarations=[add_event_tool, get_events_tool])
+            get_events_tool = genai.protos.FunctionDeclaration(name="get_events", description="Fetches events for a specific date, or for every day of a date range (e.g. 'this week') in one call.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="The date in YYYY-MM-DD format. If omitted, today's date will be used."), "end_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="Optional last day of a range (inclusive), YYYY-MM-DD, at most 31 days after date_str.")}))
+            find_free_slots_tool = genai.protos.FunctionDeclaration(name="find_free_slots", description="Finds free time slots of a given length in the calendar over a date range, within working hours.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"duration_minutes": genai.protos.Schema(type=genai.protos.Type.NUMBER, description="Minimum length of each free slot in minutes."), "start_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="First day to search, YYYY-MM-DD. Defaults to today."), "end_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="Last day to search (inclusive), YYYY-MM-DD. Defaults to 6 days after the start."), "work_start_time": genai.protos.Schema(type=genai.protos.Type.STRING, description="Earliest time of day, HH:MM. Defaults to 09:00."), "work_end_time": genai.protos.Schema(type=genai.protos.Type.STRING, description="Latest time of day, HH:MM. Defaults to 18:00."), "buffer_minutes": genai.protos.Schema(type=genai.protos.Type.NUMBER, description="Minutes to keep free before and after existing events.")}, required=["duration_minutes"]))
+            tools = genai.protos.Tool(function_declarations=[add_event_tool, get_events_tool, find_free_slots_tool])
             user_tz_str = st.session_state.user_profile['timezone']
             user_tz = pytz.timezone(user_tz_str)
             current_time = datetime.now(user_tz)
-            SYSTEM_PROMPT = f"""You are FocusFlow, a calendar assistant for {st.session_state.user_profile['name']}. Current date/time: {current_time.strftime('%Y-%m-%d %H:%M')} ({user_tz_str}). CRITICAL RULE: User is in {user_tz_str} timezone. You MUST create naive time strings in YYYY-MM-DDTHH:MM:SS format. RULES: 1. For scheduling: Call add_event. 2. For viewing: Call get_events. Infer dates like 'tomorrow'. 3. If info is missing, ask briefly."""
+            SYSTEM_PROMPT = f"""You are FocusFlow, a calendar assistant for {st.session_state.user_profile['name']}. Current date/time: {current_time.strftime('%Y-%m-%d %H:%M')} ({user_tz_str}). CRITICAL RULE: User is in {user_tz_str} timezone. You MUST create naive time strings in YYYY-MM-DDTHH:MM:SS format. RULES: 1. For scheduling: Call add_event. 2. For viewing: Call get_events. Infer dates like 'tomorrow'. For several days ('this week'), make one get_events call with date_str and end_date_str. For finding free time ('find me 2 free hours this week'): Call find_free_slots. 3. If info is missing, ask briefly. 4. For multi-action requests, call all needed functions at once, then summarize their results keeping the details."""
             model = genai.GenerativeModel(model_name="gemini-1.5-flash-latest", tools=[tools], system_instruction=SYSTEM_PROMPT)
             st.session_state.chat_session = model.start_chat(history=[])
         except Exception as e:
@@ -132,18 +141,25 @@ if st.session_state.calendar_service and st.session_state.spotify_client:
             with st.spinner("Thinking..."):
                 response = st.session_state.chat_session.send_message(user_prompt)
             if not response.parts: raise ValueError("The AI returned an empty response.")
-            part = response.parts[0]
-            if part.function_call:
-                function_call = part.function_call; tool_name = function_call.name; args = dict(function_call.args)
+            function_calls = [part.function_call for part in response.parts if part.function_call]
+            if function_calls:
                 service = st.session_state.calendar_service; user_tz = st.session_state.user_profile['timezone']
-                function_map = {'add_event': lambda **kwargs: calendar_utils.add_event(service=service, user_timezone_str=user_tz, **kwargs), 'get_events': lambda **kwargs: calendar_utils.get_events(service=service, user_timezone_str=user_tz, **kwargs)}
+                function_map = {'add_event': lambda **kwargs: calendar_utils.add_event(service=service, user_timezone_str=user_tz, **kwargs), 'get_events': lambda **kwargs: calendar_utils.get_events(service=service, user_timezone_str=user_tz, **kwargs), 'find_free_slots': lambda **kwargs: calendar_utils.find_free_slots(service=service, user_timezone_str=user_tz, **kwargs)}
+                run_tool = lambda fc: function_map[fc.name](**dict(fc.args)) if fc.name in function_map else "I tried to use a function that doesn't exist."
                 with st.spinner(f"Accessing Google Calendar..."):
-                    tool_response = function_map[tool_name](**args)
-                assistant_response = tool_response
-                if tool_name == "add_event" and assistant_response.strip().startswith("✅"):
-                    gamification_feedback = gamification_utils.award_xp(gamification_utils.XP_PER_TASK_SCHEDULED, "task")
-                    assistant_response += f"\n\n*{gamification_feedback}*"
-            elif part.text: assistant_response = part.text
+                    # Reads run concurrently; add_event calls run one after another on a single worker, so each one's
+                    # conflict check sees the events added before it. All results go back in a single round trip.
+                    with ThreadPoolExecutor(max_workers=len(function_calls)) as executor:
+                        reads = iter([executor.submit(run_tool, fc) for fc in function_calls if fc.name != "add_event"])
+                        writes = iter(executor.submit(lambda: [run_tool(fc) for fc in function_calls if fc.name == "add_event"]).result())
+                        tool_results = [next(writes) if fc.name == "add_event" else next(reads).result() for fc in function_calls]
+                    response = st.session_state.chat_session.send_message([genai.protos.Part(function_response=genai.protos.FunctionResponse(name=fc.name, response={"result": result})) for fc, result in zip(function_calls, tool_results)])
+                assistant_response = "".join(part.text for part in response.parts if part.text) or "\n\n".join(tool_results)
+                for fc, result in zip(function_calls, tool_results):
+                    if fc.name == "add_event" and result.strip().startswith("✅"):
+                        gamification_feedback = gamification_utils.award_xp(gamification_utils.XP_PER_TASK_SCHEDULED, "task")
+                        assistant_response += f"\n\n*{gamification_feedback}*"
+            elif any(part.text for part in response.parts): assistant_response = "".join(part.text for part in response.parts if part.text)
             else: assistant_response = "I received an unusual response from the AI."
         except Exception as e:
             st.error("An unexpected error occurred:"); st.exception(e)
@@ -158,6 +174,22 @@ if st.session_state.calendar_service and st.session_state.spotify_client:
     if text_prompt := st.chat_input("Schedule a task or ask about your day"):
         process_prompt(text_prompt); st.rerun()
     st.sidebar.header("Voice Assistant 🎤");
-    if st.sidebar.button("Talk to FocusFlow"):
-        transcribed_text = audio_utils.transcribe_audio_from_mic()
-        if transcribed_text: st.session_state.voice_input_text = transcribed_text; st.rerun()
\ No newline at end of file
+    # The mic is captured on a background thread; this fragment only picks up finished phrases, so the UI never freezes.
+    if audio_utils.is_listening():
+        if st.sidebar.button("Stop listening"): audio_utils.stop_background_listening(); st.rerun()
+    elif st.sidebar.button("Talk to FocusFlow"):
+        with st.sidebar, st.spinner("Starting microphone..."):
+            audio_utils.start_background_listening()
+        st.rerun()
+
+    @st.fragment(run_every=1)
+    def voice_input_listener():
+        if not audio_utils.is_listening(): return
+        st.caption("🎙️ Listening... just speak.")
+        texts, errors = audio_utils.collect_transcribed_phrases()
+        for error in errors: st.warning(error)
+        if texts:
+            st.session_state.voice_input_text = " ".join(texts)
+            st.rerun()
+
+    with st.sidebar: voice_input_listener()
\ No newline at end of file
@@ -0,0 +1,40 @@
+# benchmarks/bench_calendar_discovery.py
+"""
+Compares building a Calendar service with googleapiclient's build() against the shared,
+pre-parsed discovery document used by core.calendar_utils. Runs fully offline.
+
+    python benchmarks/bench_calendar_discovery.py
+"""
+import os
+import sys
+import time
+
+import httplib2
+from googleapiclient.discovery import build, build_from_document
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import calendar_utils
+
+ITERATIONS = 50
+
+def _time_per_call(label, fn):
+    fn() # warm-up
+    start = time.perf_counter()
+    for _ in range(ITERATIONS): fn()
+    per_call_ms = (time.perf_counter() - start) * 1000 / ITERATIONS
+    print(f"{label:<45} {per_call_ms:8.3f} ms/service")
+    return per_call_ms
+
+if __name__ == "__main__":
+    print(f"--- Calendar service construction ({ITERATIONS} iterations) ---")
+
+    cold_start = time.perf_counter()
+    document = calendar_utils._get_discovery_document()
+    print(f"{'one-time discovery load (shared document)':<45} {(time.perf_counter() - cold_start) * 1000:8.3f} ms")
+    if document is None:
+        print("No local discovery document available; nothing to compare.")
+        sys.exit(1)
+
+    before = _time_per_call("build('calendar', 'v3', static_discovery=True)", lambda: build('calendar', 'v3', http=httplib2.Http(), static_discovery=True))
+    after = _time_per_call("build_from_document(shared document)", lambda: build_from_document(document, http=httplib2.Http()))
+    print(f"\nSpeed-up: {before / after:.1f}x")
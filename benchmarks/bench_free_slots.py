@@ -0,0 +1,69 @@
+# benchmarks/bench_free_slots.py
+"""
+Times core.calendar_utils.free_slots on synthetic dense calendars (many calendars, multi-week ranges)
+against a naive finder that rescans every busy interval for each day. Runs fully offline.
+
+    python benchmarks/bench_free_slots.py
+"""
+import datetime as dt
+import os
+import random
+import sys
+import time
+
+import pytz
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import calendar_utils
+
+TIMEZONE = pytz.timezone("Europe/Berlin")
+DURATION = dt.timedelta(minutes=45)
+BUFFER = dt.timedelta(minutes=10)
+WORK_START, WORK_END = dt.time(8), dt.time(20)
+
+def synthetic_busy(calendars, days, events_per_day, seed=7):
+    """Random 15-60 minute meetings between 07:00 and 21:00 on every day, for each calendar."""
+    rng = random.Random(seed)
+    first_day = dt.date(2026, 10, 5)
+    busy = []
+    for _ in range(calendars):
+        for d in range(days):
+            day_start = TIMEZONE.localize(dt.datetime.combine(first_day + dt.timedelta(days=d), dt.time(7)))
+            for _ in range(events_per_day):
+                start = day_start + dt.timedelta(minutes=rng.randrange(0, 14 * 60, 5))
+                busy.append((start, start + dt.timedelta(minutes=rng.randrange(15, 61, 5)), None))
+    range_start = TIMEZONE.localize(dt.datetime.combine(first_day, dt.time.min))
+    return busy, range_start, range_start + dt.timedelta(days=days)
+
+def naive_free_slots(busy, range_start, range_end):
+    """Baseline: for every day, filter all busy intervals into that day's window, sort them and scan."""
+    slots = []
+    day = range_start.date()
+    while TIMEZONE.localize(dt.datetime.combine(day, dt.time.min)) < range_end:
+        window_start = TIMEZONE.localize(dt.datetime.combine(day, WORK_START))
+        window_end = TIMEZONE.localize(dt.datetime.combine(day, WORK_END))
+        todays = sorted((s - BUFFER, e + BUFFER) for s, e, _ in busy if s - BUFFER < window_end and e + BUFFER > window_start)
+        cursor = window_start
+        for s, e in todays:
+            if s - cursor >= DURATION: slots.append((cursor, s))
+            cursor = max(cursor, e)
+        if window_end - cursor >= DURATION: slots.append((cursor, window_end))
+        day += dt.timedelta(days=1)
+    return slots
+
+def _median_ms(fn, repeats=5):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter(); result = fn(); timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2], result
+
+if __name__ == "__main__":
+    print(f"{'calendars':>9} {'days':>5} {'busy':>7} {'sweep ms':>9} {'naive ms':>9} {'slots':>6}")
+    # Every case must leave some free time, otherwise the comparison below only checks two empty lists.
+    for calendars, days, per_day in [(1, 7, 8), (4, 28, 2), (8, 84, 1), (30, 364, 1)]:
+        busy, range_start, range_end = synthetic_busy(calendars, days, per_day)
+        sweep_ms, slots = _median_ms(lambda: calendar_utils.free_slots(busy, range_start, range_end, DURATION, TIMEZONE, WORK_START, WORK_END, BUFFER))
+        naive_ms, expected = _median_ms(lambda: naive_free_slots(busy, range_start, range_end), repeats=1 if len(busy) > 10000 else 3)
+        assert slots == expected, "free_slots disagrees with the naive finder"
+        assert slots, "the synthetic calendar is fully booked; lower its density"
+        print(f"{calendars:>9} {days:>5} {len(busy):>7} {sweep_ms:>9.2f} {naive_ms:>9.2f} {len(slots):>6}")
@@ -0,0 +1,76 @@
+# benchmarks/bench_speech_backends.py
+"""
+Compares end-to-end latency of the local CPU speech engine against the cloud backend. The cloud backend is
+stubbed with a fixed network round trip plus a per-audio-second processing cost, so this runs offline.
+Requires the optional dependencies: pip install faster-whisper av (the model is downloaded on first run).
+
+    python benchmarks/bench_speech_backends.py --model tiny.en --threads 4
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import av
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from core import speech_backends
+
+class StubCloudBackend(speech_backends.SpeechBackend):
+    """Sleeps like a Cloud Speech recognize call would: round trip + processing proportional to audio length."""
+    name = "cloud-stub"
+
+    def __init__(self, round_trip_seconds, seconds_per_audio_second):
+        self.round_trip_seconds = round_trip_seconds
+        self.seconds_per_audio_second = seconds_per_audio_second
+
+    def transcribe(self, audio_bytes, encoding="ogg_opus"):
+        duration = len(speech_backends.decode_audio(audio_bytes)) / speech_backends.SAMPLE_RATE
+        time.sleep(self.round_trip_seconds + duration * self.seconds_per_audio_second)
+        return ""
+
+def synthetic_voice_note(seconds, sample_rate=48000):
+    """Encodes a speech-like signal (modulated harmonics + noise) as OGG/Opus, like a Telegram voice note."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 3 * t))
+    signal = envelope * sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440)))
+    signal = (0.3 * signal + 0.01 * np.random.default_rng(0).standard_normal(t.size)).astype(np.float32)
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=sample_rate, layout="mono")
+        for start in range(0, signal.size, 960):
+            frame = av.AudioFrame.from_ndarray(signal[start:start + 960].reshape(1, -1), format="flt", layout="mono")
+            frame.sample_rate = sample_rate
+            for packet in stream.encode(frame): container.mux(packet)
+        for packet in stream.encode(None): container.mux(packet)
+    return buffer.getvalue()
+
+def _median_ms(backend, audio_bytes, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.transcribe(audio_bytes)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="tiny.en")
+    parser.add_argument("--threads", type=int, default=speech_backends.LOCAL_CPU_THREADS)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--cloud-rtt", type=float, default=0.35, help="Stubbed cloud round trip in seconds.")
+    parser.add_argument("--cloud-rate", type=float, default=0.05, help="Stubbed cloud processing seconds per audio second.")
+    args = parser.parse_args()
+
+    load_start = time.perf_counter()
+    local = speech_backends.LocalWhisperBackend(model_size=args.model, cpu_threads=args.threads)
+    print(f"Local model '{args.model}' loaded and warmed up in {time.perf_counter() - load_start:.2f} s ({args.threads} threads)\n")
+    cloud = StubCloudBackend(args.cloud_rtt, args.cloud_rate)
+
+    print(f"{'clip':>6} {'decode':>10} {'local':>10} {'cloud-stub':>12}")
+    for seconds in (2, 5, 10):
+        clip = synthetic_voice_note(seconds)
+        decode_start = time.perf_counter(); speech_backends.decode_audio(clip); decode_ms = (time.perf_counter() - decode_start) * 1000
+        print(f"{seconds:>5}s {decode_ms:>8.1f}ms {_median_ms(local, clip, args.repeats):>8.1f}ms {_median_ms(cloud, clip, args.repeats):>10.1f}ms")
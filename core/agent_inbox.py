@@ -0,0 +1,97 @@
+# core/agent_inbox.py
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows: multi-worker serving is not supported there
+    fcntl = None
+
+class SharedInbox:
+    """
+    SQLite-backed inbox that lets several ASGI worker processes share one webhook.
+    Whichever worker receives an update stores it here and acknowledges. Chats are partitioned by
+    chat_id across `partitions` slots and every worker owns exactly one slot (held with a file lock),
+    so all updates of a chat are processed by the same process, in update_id order. Per-process caches
+    (credentials, Gemini sessions) therefore stay valid and per-chat ordering still holds.
+    Rows are only deleted once processed; rows left 'claimed' by a crashed worker are released again
+    when its replacement takes over the slot.
+    """
+
+    def __init__(self, db_path, partitions):
+        self.db_path = db_path
+        self.partitions = partitions
+        self.partition = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS inbox (
+            update_id INTEGER PRIMARY KEY,
+            partition INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            received_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_inbox_partition ON inbox (partition, status, update_id)")
+
+    def partition_for(self, chat_id):
+        return int(chat_id) % self.partitions
+
+    def claim_partition(self):
+        """Takes the first free partition slot for this process and releases rows a previous owner left claimed."""
+        if fcntl is None: raise RuntimeError("Multi-worker serving requires fcntl (Linux/macOS).")
+        lock_dir = os.path.join(os.path.dirname(self.db_path) or ".", "partitions")
+        os.makedirs(lock_dir, exist_ok=True)
+        while self.partition is None:
+            for partition in range(self.partitions):
+                lock_file = open(os.path.join(lock_dir, f"{partition}.lock"), 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+                self._lock_file, self.partition = lock_file, partition
+                break
+            else:
+                time.sleep(1) # all slots taken, e.g. an old worker is still draining
+        with self._lock:
+            self._db.execute("UPDATE inbox SET status = 'pending' WHERE partition = ? AND status = 'claimed'", (self.partition,))
+        return self.partition
+
+    def release_partition(self):
+        if self._lock_file is not None:
+            self._lock_file.close() # closing the file drops the flock
+            self._lock_file, self.partition = None, None
+
+    def put(self, update_id, chat_id, payload):
+        """Stores an update. Returns False if it was already stored (a duplicate delivery)."""
+        with self._lock:
+            cursor = self._db.execute("INSERT OR IGNORE INTO inbox (update_id, partition, payload, received_at) VALUES (?, ?, ?, ?)",
+                                      (update_id, self.partition_for(chat_id), payload, time.time()))
+            return cursor.rowcount == 1
+
+    def claim(self, limit=100):
+        """Returns up to `limit` pending (update_id, payload) rows of this process's partition, oldest first, and marks them claimed."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            rows = self._db.execute("SELECT update_id, payload FROM inbox WHERE partition = ? AND status = 'pending' ORDER BY update_id LIMIT ?",
+                                    (self.partition, limit)).fetchall()
+            if rows: self._db.executemany("UPDATE inbox SET status = 'claimed' WHERE update_id = ?", [(row[0],) for row in rows])
+            self._db.execute("COMMIT")
+            return rows
+
+    def unclaim(self, update_ids):
+        with self._lock:
+            self._db.executemany("UPDATE inbox SET status = 'pending' WHERE update_id = ?", [(u,) for u in update_ids])
+
+    def done(self, update_id):
+        with self._lock:
+            self._db.execute("DELETE FROM inbox WHERE update_id = ?", (update_id,))
+
+    def backlog(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM inbox").fetchone()[0]
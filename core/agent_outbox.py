@@ -0,0 +1,162 @@
+# core/agent_outbox.py
+import asyncio
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until one token is available (0 if one is available now)."""
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    async def acquire(self):
+        while (wait := self.delay()) > 0: await asyncio.sleep(wait)
+        self.consume()
+
+class TelegramOutbox:
+    """
+    Centralized outbound queue for bot replies.
+    Messages are rate limited by a global token bucket and one bucket per chat (Telegram allows roughly
+    30 messages/s overall and about 1/s per chat). Messages still waiting for the same chat are coalesced
+    into one, and a 429 RetryAfter pauses only that chat before the message is retried. Messages to a chat
+    are always delivered in the order they were queued.
+    """
+
+    def __init__(self, bot, global_rate=25, per_chat_rate=1, per_chat_burst=3, max_workers=8, max_attempts=5):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {} # chat_id -> TokenBucket
+        self._pending = {} # chat_id -> deque of texts waiting to be sent
+        self._blocked_until = {} # chat_id -> monotonic time a RetryAfter expires
+        self._attempts = {} # chat_id -> consecutive failed attempts for the head message
+        self._scheduled = set() # chats that are queued in _ready or currently being sent
+        self._ready = None
+        self._workers = []
+        self._unsent = 0
+        self._idle = None
+        self.stats = {"queued": 0, "sent": 0, "coalesced": 0, "rate_limited": 0, "retried": 0, "dropped": 0}
+
+    def start(self):
+        """Starts the sender tasks. Must be called from within the running event loop."""
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event(); self._idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def send(self, chat_id, text):
+        """Queues a message for delivery; never blocks. Texts over Telegram's length limit are split."""
+        chat_id = str(chat_id)
+        pending = self._pending.setdefault(chat_id, deque())
+        for start in range(0, max(len(text), 1), TELEGRAM_MAX_MESSAGE_LENGTH):
+            pending.append(text[start:start + TELEGRAM_MAX_MESSAGE_LENGTH])
+            self._unsent += 1
+            self.stats["queued"] += 1
+        self._idle.clear()
+        if len(self._chat_buckets) > 10000: self._prune_buckets()
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._ready.put_nowait(chat_id)
+
+    def _prune_buckets(self):
+        # A full bucket carries no rate-limit state, so idle chats can be forgotten safely.
+        for chat_id in [c for c, b in self._chat_buckets.items() if c not in self._scheduled and b.delay() == 0 and b.tokens >= b.capacity]:
+            del self._chat_buckets[chat_id]
+
+    def _take_coalesced(self, pending):
+        texts = [pending.popleft()]
+        length = len(texts[0])
+        while pending and length + 2 + len(pending[0]) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+            length += 2 + len(pending[0])
+            texts.append(pending.popleft())
+        return texts
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            bucket = self._chat_buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate, self.per_chat_burst))
+            delay = max(bucket.delay(), self._blocked_until.get(chat_id, 0) - time.monotonic())
+            if delay > 0:
+                # Not allowed to send to this chat yet; hand it back to the queue later instead of holding a worker.
+                loop.call_later(delay, self._ready.put_nowait, chat_id)
+                continue
+
+            await self._global_bucket.acquire()
+            bucket.consume()
+            pending = self._pending[chat_id]
+            texts = self._take_coalesced(pending)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text="\n\n".join(texts))
+                self._unsent -= len(texts)
+                self._attempts.pop(chat_id, None)
+                self.stats["sent"] += 1
+                self.stats["coalesced"] += len(texts) - 1
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self._blocked_until[chat_id] = time.monotonic() + retry_after
+                pending.extendleft(reversed(texts))
+                self.stats["rate_limited"] += 1
+            except (NetworkError, asyncio.TimeoutError) as e:
+                attempts = self._attempts[chat_id] = self._attempts.get(chat_id, 0) + 1
+                if attempts >= self.max_attempts:
+                    print(f"Dropping message to chat {chat_id} after {attempts} attempts: {e}")
+                    self._unsent -= len(texts); self._attempts.pop(chat_id, None)
+                    self.stats["dropped"] += len(texts)
+                else:
+                    self._blocked_until[chat_id] = time.monotonic() + min(2 ** attempts, 30)
+                    pending.extendleft(reversed(texts))
+                    self.stats["retried"] += 1
+            except TelegramError as e:
+                # Permanent errors (chat not found, bot blocked, bad request) are not worth retrying.
+                print(f"Could not send message to chat {chat_id}: {e}")
+                self._unsent -= len(texts)
+                self.stats["dropped"] += len(texts)
+            except Exception as e:
+                # Anything unexpected must not end this sender: drop the message and keep serving other chats.
+                print(f"Unexpected error sending message to chat {chat_id}, dropping it: {e!r}")
+                self._unsent -= len(texts); self._attempts.pop(chat_id, None)
+                self.stats["dropped"] += len(texts)
+            finally:
+                if pending:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._pending[chat_id]
+                    self._scheduled.discard(chat_id)
+                    self._blocked_until.pop(chat_id, None)
+                if self._unsent == 0: self._idle.set()
+
+    async def drain(self, timeout=30):
+        """Waits up to `timeout` seconds for queued messages to be delivered, then stops the senders."""
+        if self._idle is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"WARNING: Shutdown timed out with {self._unsent} message(s) unsent.")
+        for worker in self._workers: worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
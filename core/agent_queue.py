@@ -0,0 +1,81 @@
+# core/agent_queue.py
+import asyncio
+from collections import deque
+
+class ChatJobQueue:
+    """
+    In-process job queue for the Telegram agent.
+    Jobs for the same chat run strictly in FIFO order, one at a time, while different chats are
+    processed in parallel by a fixed set of workers. `submit` never blocks: when the queue is full
+    it returns False so the caller can push back (e.g. let Telegram retry the delivery later).
+    """
+
+    def __init__(self, handler, max_workers=8, max_pending=1000, max_pending_per_chat=50):
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self._chat_jobs = {} # chat_id -> deque of pending jobs
+        self._ready_chats = None # chats with pending jobs and no job in flight, in arrival order
+        self._workers = []
+        self._pending = 0
+        self._idle = None
+        self._accepting = False
+        self.stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        """Starts the worker tasks. Must be called from within the running event loop."""
+        self._ready_chats = asyncio.Queue()
+        self._idle = asyncio.Event(); self._idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        self._accepting = True
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, chat_id, job):
+        """Queues a job for a chat. Returns False (and drops the job) if the queue is full or shutting down."""
+        jobs = self._chat_jobs.get(chat_id)
+        if not self._accepting or self._pending >= self.max_pending or (jobs and len(jobs) >= self.max_pending_per_chat):
+            self.stats["rejected"] += 1
+            return False
+        if jobs is None:
+            # No pending or in-flight job for this chat, so it becomes ready immediately.
+            jobs = self._chat_jobs[chat_id] = deque()
+            self._ready_chats.put_nowait(chat_id)
+        jobs.append(job)
+        self._pending += 1
+        self._idle.clear()
+        self.stats["submitted"] += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready_chats.get()
+            jobs = self._chat_jobs[chat_id]
+            job = jobs.popleft()
+            try:
+                await self.handler(job)
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Error processing job for chat {chat_id}: {e}")
+            finally:
+                self._pending -= 1
+                # Re-queue the chat behind the others so one busy chat cannot monopolise a worker.
+                if jobs: self._ready_chats.put_nowait(chat_id)
+                else: del self._chat_jobs[chat_id]
+                if self._pending == 0: self._idle.set()
+
+    async def drain(self, timeout=30):
+        """Stops accepting jobs, waits up to `timeout` seconds for queued work to finish, then stops the workers."""
+        self._accepting = False
+        if self._idle is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"WARNING: Shutdown timed out with {self._pending} job(s) still pending.")
+        for worker in self._workers: worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
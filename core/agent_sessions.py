@@ -0,0 +1,68 @@
+# core/agent_sessions.py
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+
+class ChatSessionCache:
+    """
+    Keeps one Gemini chat session per Telegram chat so follow-ups ("make it 5pm instead") have context.
+    Models are shared by every chat in the same timezone and rebuilt when the local date rolls over, since
+    the system prompt carries the current date; the bounded history is carried over to the new model.
+    Sessions idle for longer than `idle_seconds` are evicted, and the least recently used session is
+    dropped once `max_sessions` is reached.
+    """
+
+    def __init__(self, model_factory, max_sessions=1000, idle_seconds=3600, max_turns=10):
+        self.model_factory = model_factory # (timezone_str, date_str) -> genai.GenerativeModel
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_turns = max_turns
+        self._models = {} # (timezone_str, date_str) -> model
+        self._sessions = OrderedDict() # chat_id -> {"chat", "model_key", "last_used"}
+
+    def _get_model(self, model_key):
+        model = self._models.get(model_key)
+        if model is None:
+            timezone_str = model_key[0]
+            # Drop the previous day's model for this timezone before building today's.
+            for stale_key in [k for k in self._models if k[0] == timezone_str]: del self._models[stale_key]
+            model = self._models[model_key] = self.model_factory(*model_key)
+        return model
+
+    def _evict(self, now):
+        for chat_id in [c for c, entry in self._sessions.items() if now - entry["last_used"] > self.idle_seconds]:
+            del self._sessions[chat_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, chat_id, timezone_str):
+        """Returns the chat session for `chat_id`, creating it (or moving it to today's model) if needed."""
+        now = time.monotonic()
+        self._evict(now)
+        model_key = (timezone_str, datetime.now(pytz.timezone(timezone_str)).strftime('%Y-%m-%d'))
+        entry = self._sessions.get(chat_id)
+        if entry is None or entry["model_key"] != model_key:
+            history = self._trimmed(entry["chat"].history) if entry else []
+            entry = {"chat": self._get_model(model_key).start_chat(history=history), "model_key": model_key}
+            self._sessions[chat_id] = entry
+        entry["last_used"] = now
+        self._sessions.move_to_end(chat_id)
+        self._evict(now)
+        return entry["chat"]
+
+    def _trimmed(self, history):
+        # A turn starts at a user message with text; function responses belong to the turn before them.
+        turn_starts = [i for i, content in enumerate(history) if content.role == "user" and any(part.text for part in content.parts)]
+        if len(turn_starts) <= self.max_turns: return list(history)
+        return list(history[turn_starts[-self.max_turns]:])
+
+    def trim(self, chat_id):
+        """Bounds a session's history to the last `max_turns` user turns."""
+        entry = self._sessions.get(chat_id)
+        if entry: entry["chat"].history = self._trimmed(entry["chat"].history)
+
+    def reset(self, chat_id):
+        """Forgets a chat's conversation, e.g. after an error left its history in a bad state."""
+        self._sessions.pop(chat_id, None)
@@ -1,17 +1,55 @@
 # audio_utils.py
 import speech_recognition as sr
 from gtts import gTTS
+import base64
+import hashlib
 import io
+import json
+import os
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import streamlit.components.v1 as components
+
+import numpy as np
+
+from core import speech_backends, voice_activity
+from core.disk_cache import DiskLRUCache
+
+def _recognize_phrase(recognizer, audio):
+    """Trims silence from a captured phrase and transcribes it. Raises sr.UnknownValueError / sr.RequestError."""
+    # Cut leading/trailing silence and long pauses before recognition.
+    samples = np.frombuffer(audio.get_raw_data(convert_rate=speech_backends.SAMPLE_RATE, convert_width=2), dtype=np.int16).astype(np.float32) / 32768
+    samples = voice_activity.trim_silence(samples)
+    if samples.size == 0: raise sr.UnknownValueError()
+    if speech_backends.SPEECH_BACKEND == "local":
+        # Offline engine: model stays warm in this process, no network round trip per utterance.
+        text = speech_backends.get_backend().transcribe_pcm(samples)
+        if not text: raise sr.UnknownValueError()
+        return text
+    # recognize_google uploads the trimmed audio as FLAC.
+    audio = sr.AudioData((samples * 32767).astype(np.int16).tobytes(), speech_backends.SAMPLE_RATE, 2)
+    return recognizer.recognize_google(audio)
+
+def _calibrated_recognizer():
+    """Returns a Recognizer using this session's ambient-noise calibration, measuring it only the first time."""
+    r = sr.Recognizer()
+    if "mic_energy_threshold" in st.session_state:
+        r.energy_threshold = st.session_state.mic_energy_threshold
+    else:
+        with sr.Microphone() as source:
+            r.adjust_for_ambient_noise(source)
+        st.session_state.mic_energy_threshold = r.energy_threshold
+    return r
 
 def transcribe_audio_from_mic():
     """Captures audio from the microphone and transcribes it to text."""
-    r = sr.Recognizer()
+    r = _calibrated_recognizer()
     with sr.Microphone() as source:
         st.info("Listening... Speak now!")
         try:
-            # Adjust for ambient noise once
-            r.adjust_for_ambient_noise(source)
             audio = r.listen(source, timeout=5, phrase_time_limit=10)
         except sr.WaitTimeoutError:
             st.warning("Listening timed out. Please try again.")
@@ -19,8 +57,7 @@ def transcribe_audio_from_mic():
 
     try:
         st.info("Transcribing...")
-        text = r.recognize_google(audio)
-        return text
+        return _recognize_phrase(r, audio)
     except sr.UnknownValueError:
         st.error("Sorry, I could not understand the audio.")
         return ""
@@ -28,16 +65,108 @@ def transcribe_audio_from_mic():
         st.error(f"Could not request results from Google Speech Recognition service; {e}")
         return ""
 
-def text_to_speech_autoplay(text):
-    """Converts text to speech and returns an audio element that autoplays."""
-    try:
-        tts = gTTS(text=text, lang='en')
+# --- BACKGROUND LISTENING ---
+# The mic is captured on speech_recognition's listener thread, so the Streamlit script never blocks. Each phrase is
+# handed to a recognition thread as soon as it ends and the results are collected in a per-session queue.
+_recognition_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mic-recognition")
+
+def start_background_listening(phrase_time_limit=10):
+    """Starts listening in the background for this session (no-op if already listening)."""
+    if st.session_state.get("mic_stop_listening"): return
+    r = _calibrated_recognizer()
+    phrases = queue.Queue()
+
+    def recognize_into_queue(audio):
+        try:
+            phrases.put(("text", _recognize_phrase(r, audio)))
+        except sr.UnknownValueError:
+            phrases.put(("error", "Sorry, I could not understand the audio."))
+        except sr.RequestError as e:
+            phrases.put(("error", f"Could not request results from Google Speech Recognition service; {e}"))
+
+    # Called on the listener thread when a phrase ends; recognition runs elsewhere so capture continues.
+    on_phrase = lambda recognizer, audio: _recognition_executor.submit(recognize_into_queue, audio)
+    st.session_state.mic_phrases = phrases
+    st.session_state.mic_stop_listening = r.listen_in_background(sr.Microphone(), on_phrase, phrase_time_limit=phrase_time_limit)
+
+def stop_background_listening():
+    stop_listening = st.session_state.get("mic_stop_listening")
+    if stop_listening: stop_listening(wait_for_stop=False)
+    st.session_state.mic_stop_listening = None
+
+def is_listening():
+    return bool(st.session_state.get("mic_stop_listening"))
+
+def collect_transcribed_phrases():
+    """Returns (texts, errors) recognized since the last call, without blocking."""
+    texts, errors = [], []
+    phrases = st.session_state.get("mic_phrases")
+    while phrases is not None and not phrases.empty():
+        kind, value = phrases.get_nowait()
+        (texts if kind == "text" else errors).append(value)
+    return texts, errors
+
+# --- TEXT-TO-SPEECH ---
+# gTTS replies are cached on disk by (text, lang), so repeated confirmations never hit the network again.
+tts_cache = DiskLRUCache(
+    os.environ.get("TTS_CACHE_DB", os.path.join("data", "tts_cache.db")),
+    max_bytes=int(os.environ.get("TTS_CACHE_MAX_BYTES", 100 * 1024 * 1024)),
+    ttl_seconds=int(os.environ.get("TTS_CACHE_TTL_SECONDS", 90 * 24 * 3600)),
+)
+TTS_MAX_CHUNK_CHARS = 200
+GTTS_MP3_BYTES_PER_SECOND = 32000 / 8 # gTTS returns 32 kbps mono MP3
+_tts_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+def split_into_speech_chunks(text, max_chars=TTS_MAX_CHUNK_CHARS):
+    """Splits text at sentence boundaries into chunks of at most ~max_chars, keeping whole sentences together."""
+    chunks, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current); current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current: chunks.append(current)
+    return chunks
+
+def synthesize_speech(text, lang='en'):
+    """Returns MP3 bytes for `text`, from the cache when possible."""
+    key = hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+    audio_bytes = tts_cache.get(key)
+    if audio_bytes is None:
         audio_fp = io.BytesIO()
-        tts.write_to_fp(audio_fp)
-        audio_fp.seek(0)
-        
+        gTTS(text=text, lang=lang).write_to_fp(audio_fp)
+        audio_bytes = audio_fp.getvalue()
+        tts_cache.set(key, audio_bytes)
+    return audio_bytes
+
+def text_to_speech_autoplay(text, lang='en'):
+    """
+    Converts text to speech and returns an audio element that autoplays.
+    Long replies are split at sentence boundaries and the chunks are synthesized in parallel; the first chunk
+    starts playing as soon as it is ready and the rest are queued to play after it.
+    """
+    try:
+        chunks = split_into_speech_chunks(text)
+        if not chunks: return None
+        futures = [_tts_executor.submit(synthesize_speech, chunk, lang) for chunk in chunks]
+        first_audio = futures[0].result()
         # Use st.audio with autoplay=True
-        return st.audio(audio_fp, format='audio/mp3', autoplay=True)
+        first_player = st.audio(first_audio, format='audio/mp3', autoplay=True)
+        started_at = time.monotonic()
+        if len(futures) > 1:
+            remaining = [base64.b64encode(future.result()).decode("ascii") for future in futures[1:]]
+            # Start the queue when the first chunk should be finishing (duration estimated from the MP3 bitrate).
+            delay_ms = max(0, int((len(first_audio) / GTTS_MP3_BYTES_PER_SECOND - (time.monotonic() - started_at)) * 1000))
+            components.html(f"""<script>
+                const clips = {json.dumps(remaining)}; let next = 0;
+                function playNext() {{
+                    if (next >= clips.length) return;
+                    const audio = new Audio("data:audio/mp3;base64," + clips[next++]);
+                    audio.onended = playNext; audio.play();
+                }}
+                setTimeout(playNext, {delay_ms});
+            </script>""", height=0)
+        return first_player
     except Exception as e:
         st.error(f"Failed to generate audio: {e}")
-        return None
\ No newline at end of file
+        return None
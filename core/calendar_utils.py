@@ -1,26 +1,113 @@
 # core/calendar_utils.py
 import datetime as dt
+import json
+import hashlib
 import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
 import pytz
 import httplib2
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
 from googleapiclient.errors import HttpError
 from google_auth_httplib2 import AuthorizedHttp
 
+from core.event_mirror import MIRROR_DIR, EventMirror
+
 SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
 CREDENTIALS_FILE = "credentials.json"
+# Optional path to a pre-downloaded calendar v3 discovery document. When unset, the copy bundled with googleapiclient is used.
+DISCOVERY_DOCUMENT_PATH = os.environ.get("CALENDAR_DISCOVERY_DOCUMENT")
+
+# --- PER-USER SERVICE POOL CONFIGURATION (Telegram agent) ---
+SERVICE_POOL_MAX_SIZE = int(os.environ.get("CALENDAR_POOL_MAX_SIZE", 256))
+SERVICE_POOL_IDLE_SECONDS = int(os.environ.get("CALENDAR_POOL_IDLE_SECONDS", 30 * 60))
+CREDS_REFRESH_MARGIN_SECONDS = 5 * 60 # Refresh tokens this long before they actually expire
+
+_service_pool = OrderedDict() # pool_key -> {"service", "creds", "token_path", "last_used", "lock"}
+_service_pool_lock = threading.Lock()
+
+_discovery_document = None
+_discovery_document_lock = threading.Lock()
+
+# --- LOCAL EVENT MIRRORS ---
+# Day views and conflict checks are answered from a per-user SQLite mirror (see core/event_mirror.py) when the
+# service was built from a user's token file; services we can't attribute to a user keep querying the API.
+CALENDAR_MIRROR_ENABLED = os.environ.get("CALENDAR_MIRROR", "1") == "1"
+_service_token_paths = weakref.WeakKeyDictionary() # service -> user_token_path
+# Mirrors hold an open SQLite connection and an in-memory index each, so they are capped like the service pool.
+MIRROR_POOL_MAX_SIZE = int(os.environ.get("CALENDAR_MIRROR_POOL_MAX_SIZE", SERVICE_POOL_MAX_SIZE))
+MIRROR_POOL_IDLE_SECONDS = int(os.environ.get("CALENDAR_MIRROR_POOL_IDLE_SECONDS", SERVICE_POOL_IDLE_SECONDS))
+_mirrors = OrderedDict() # user_token_path -> {"mirror", "last_used"}
+_mirrors_lock = threading.Lock()
+
+# --- SHARED DISCOVERY DOCUMENT ---
+def _get_discovery_document():
+    """
+    Loads and parses the calendar v3 discovery document once per process.
+    Every service built afterwards shares the same parsed dict, so building a service is a cheap wrapper
+    instead of re-reading (and possibly re-fetching) the document. Returns None if no local copy is available.
+    """
+    global _discovery_document
+    if _discovery_document is not None: return _discovery_document
+    with _discovery_document_lock:
+        if _discovery_document is None:
+            try:
+                if DISCOVERY_DOCUMENT_PATH:
+                    with open(DISCOVERY_DOCUMENT_PATH, 'r') as f: content = f.read()
+                else:
+                    content = discovery_cache.get_static_doc('calendar', 'v3')
+                if content:
+                    document = json.loads(content)
+                    # build_from_document fixes up method parameters in place; do it once here, before the dict is shared across threads.
+                    build_from_document(document, http=httplib2.Http())
+                    _discovery_document = document
+            except Exception as e:
+                print(f"WARNING: Could not load the local Calendar discovery document, falling back to build(). {e}")
+    return _discovery_document
+
+class _PerThreadHttp:
+    """
+    httplib2.Http is not thread-safe. This stand-in gives every thread its own persistent Http, so one
+    service (and its credentials) can serve concurrent tool calls while each thread keeps its connection alive.
+    """
+    def __init__(self, timeout=15):
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None: http = self._local.http = httplib2.Http(timeout=self._timeout)
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def close(self):
+        self._http().close()
+
+    def __getattr__(self, name):
+        return getattr(self._http(), name)
 
 # --- No changes needed in these authentication functions ---
-def _build_service_with_creds(creds):
+def _build_service_with_creds(creds, user_token_path=None):
     if not creds: return None
     try:
-        http_client = httplib2.Http(timeout=15)
+        http_client = _PerThreadHttp(timeout=15)
         authorized_http = AuthorizedHttp(creds, http=http_client)
-        service = build('calendar', 'v3', http=authorized_http)
+        document = _get_discovery_document()
+        if document is not None:
+            service = build_from_document(document, http=authorized_http)
+        else:
+            service = build('calendar', 'v3', http=authorized_http)
+        if user_token_path: _service_token_paths[service] = user_token_path
         return service
     except Exception as e:
         print(f"ERROR: Could not build Google Calendar service. {e}")
@@ -39,7 +126,7 @@ def get_calendar_service_for_streamlit(user_token_path):
             creds = flow.run_local_server(port=0)
         with open(user_token_path, 'w') as token:
             token.write(creds.to_json())
-    return _build_service_with_creds(creds)
+    return _build_service_with_creds(creds, user_token_path)
 
 def get_calendar_service_for_agent(user_token_path):
     creds = None
@@ -49,17 +136,156 @@ def get_calendar_service_for_agent(user_token_path):
         if creds and creds.expired and creds.refresh_token:
             try:
                 creds.refresh(Request())
-                with open(user_token_path, 'w') as token: token.write(creds.to_json())
+                _write_token(user_token_path, creds)
             except Exception: return None
         else: return None
-    return _build_service_with_creds(creds)
+    return _build_service_with_creds(creds, user_token_path)
+
+# --- PER-USER SERVICE POOL ---
+def _write_token(user_token_path, creds):
+    # Write-then-rename: several agent worker processes may refresh the same user's token concurrently.
+    tmp_path = f"{user_token_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as token: token.write(creds.to_json())
+    os.replace(tmp_path, user_token_path)
+
+def _refresh_creds_if_expiring(creds, user_token_path):
+    """Refreshes credentials that are invalid or about to expire, persisting the new token. Returns False on failure."""
+    expiring = creds.expiry is not None and (creds.expiry - dt.datetime.utcnow()).total_seconds() < CREDS_REFRESH_MARGIN_SECONDS
+    if creds.valid and not expiring: return True
+    if not creds.refresh_token: return False
+    try:
+        creds.refresh(Request())
+        _write_token(user_token_path, creds)
+        return True
+    except Exception as e:
+        print(f"ERROR: Could not refresh Google credentials for {user_token_path}. {e}")
+        return False
+
+def _evict_idle_services(now):
+    for key in [k for k, entry in _service_pool.items() if now - entry["last_used"] > SERVICE_POOL_IDLE_SECONDS]:
+        del _service_pool[key]
+    while len(_service_pool) > SERVICE_POOL_MAX_SIZE:
+        _service_pool.popitem(last=False)
+
+def get_pooled_calendar_service(pool_key, user_token_path):
+    """
+    Returns a long-lived Calendar service for one user (e.g. a Telegram chat_id).
+    Services are kept in an LRU pool with idle expiry so the discovery document, credentials
+    and the underlying HTTP connection are reused across messages. Credentials are refreshed
+    proactively shortly before they expire.
+    """
+    now = time.monotonic()
+    with _service_pool_lock:
+        _evict_idle_services(now)
+        entry = _service_pool.get(pool_key)
+        if entry and entry["token_path"] == user_token_path:
+            entry["last_used"] = now
+            _service_pool.move_to_end(pool_key)
+        else:
+            entry = None
+
+    if entry:
+        with entry["lock"]:
+            if _refresh_creds_if_expiring(entry["creds"], user_token_path): return entry["service"]
+        invalidate_pooled_calendar_service(pool_key)
+        return None
+
+    if not os.path.exists(user_token_path): return None
+    creds = Credentials.from_authorized_user_file(user_token_path, SCOPES)
+    if not _refresh_creds_if_expiring(creds, user_token_path): return None
+    service = _build_service_with_creds(creds, user_token_path)
+    if not service: return None
 
+    with _service_pool_lock:
+        _service_pool[pool_key] = {"service": service, "creds": creds, "token_path": user_token_path, "last_used": time.monotonic(), "lock": threading.Lock()}
+        _service_pool.move_to_end(pool_key)
+        _evict_idle_services(time.monotonic())
+    return service
 
-def get_events(service, user_timezone_str, date_str=None):
+def invalidate_pooled_calendar_service(pool_key):
+    """Drops a user's pooled service, e.g. after their token was revoked or replaced."""
+    with _service_pool_lock:
+        _service_pool.pop(pool_key, None)
+
+
+def _evict_idle_mirrors(now):
+    # The on-disk mirror survives eviction; only the connection and the in-memory index are released.
+    evicted = [k for k, entry in _mirrors.items() if now - entry["last_used"] > MIRROR_POOL_IDLE_SECONDS]
+    for key in evicted: _mirrors.pop(key)["mirror"].close()
+    while len(_mirrors) > MIRROR_POOL_MAX_SIZE:
+        _mirrors.popitem(last=False)[1]["mirror"].close()
+
+def get_event_mirror(service):
+    """Returns the synced local mirror of this service's primary calendar, or None if mirroring isn't available."""
+    if not CALENDAR_MIRROR_ENABLED: return None
+    try:
+        user_token_path = _service_token_paths.get(service)
+    except TypeError: return None
+    if not user_token_path: return None
+    now = time.monotonic()
+    with _mirrors_lock:
+        entry = _mirrors.get(user_token_path)
+        if entry is None:
+            db_name = hashlib.sha256(os.path.abspath(user_token_path).encode("utf-8")).hexdigest()[:16]
+            entry = _mirrors[user_token_path] = {"mirror": EventMirror(os.path.join(MIRROR_DIR, f"{db_name}.db"))}
+        entry["last_used"] = now
+        _mirrors.move_to_end(user_token_path)
+        _evict_idle_mirrors(now)
+        mirror = entry["mirror"]
+    try:
+        mirror.sync(service)
+        return mirror
+    except Exception as e:
+        print(f"WARNING: Calendar mirror sync failed, querying the API directly. {e}")
+        return None
+
+def _events_between(service, start_dt, end_dt, user_timezone_str):
+    """Events overlapping [start_dt, end_dt) ordered by start, from the local mirror when possible, else lazily page by page."""
+    mirror = get_event_mirror(service)
+    if mirror is not None:
+        try:
+            return iter(mirror.query(start_dt, end_dt))
+        except sqlite3.ProgrammingError: pass # evicted and closed by another thread after the lookup
+    return iter_events(service, start_dt.isoformat(), end_dt.isoformat(), user_timezone_str)
+
+MAX_RANGE_DAYS = 31
+
+def get_events_range(service, user_timezone_str, start_date_str, end_date_str):
+    """
+    Fetches events from start_date_str through end_date_str (YYYY-MM-DD, inclusive) with one events.list over
+    the whole range, iterating result pages lazily, and groups them by local day.
+    """
+    if not service: return "Error: Could not connect to Google Calendar."
+    try:
+        user_tz = pytz.timezone(user_timezone_str)
+        first_day = dt.datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else dt.datetime.now(user_tz).date()
+        last_day = dt.datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        if last_day < first_day: first_day, last_day = last_day, first_day
+        if (last_day - first_day).days > MAX_RANGE_DAYS: return f"Please end the range at most {MAX_RANGE_DAYS} days after its first day."
+        range_start = user_tz.localize(dt.datetime.combine(first_day, dt.time.min))
+        range_end = user_tz.localize(dt.datetime.combine(last_day + dt.timedelta(days=1), dt.time.min))
+        span = f"from {first_day.strftime('%B %d')} to {last_day.strftime('%B %d, %Y')}"
+
+        days = OrderedDict() # local date -> lines, in start order (events arrive sorted by start time)
+        for event in _events_between(service, range_start, range_end, user_timezone_str):
+            start, _ = _event_bounds(event, user_tz)
+            # Events that began before the range (multi-day trips, all-day spans) are listed on its first day.
+            start = max(start.astimezone(user_tz), range_start)
+            when = "all day" if 'date' in event['start'] else f"at {start.strftime('%I:%M %p')}"
+            days.setdefault(start.date(), []).append(f"- **{event.get('summary', '(No title)')}** {when}")
+        if not days: return f"Your schedule is clear {span}! ✨"
+        sections = [f"**{day.strftime('%A, %B %d')}**\n" + "\n".join(lines) for day, lines in days.items()]
+        return f"Here is your schedule {span}:\n\n" + "\n\n".join(sections)
+    except Exception as e:
+        return f"A system error occurred while fetching events: {e}"
+
+def get_events(service, user_timezone_str, date_str=None, end_date_str=None):
     """
     Fetches events for a specific date string (YYYY-MM-DD).
-    Defaults to the current day if no date is provided.
+    Defaults to the current day if no date is provided. With end_date_str, returns every day up to and
+    including that date, grouped by day (see get_events_range).
     """
+    if end_date_str and end_date_str != date_str: return get_events_range(service, user_timezone_str, date_str, end_date_str)
     if not service: return "Error: Could not connect to Google Calendar."
     try:
         user_tz = pytz.timezone(user_timezone_str)
@@ -74,15 +300,7 @@ def get_events(service, user_timezone_str, date_str=None):
         start_of_day = user_tz.localize(dt.datetime.combine(target_date, dt.time.min))
         end_of_day = user_tz.localize(dt.datetime.combine(target_date, dt.time.max))
 
-        events_result = service.events().list(
-            calendarId='primary', 
-            timeMin=start_of_day.isoformat(), 
-            timeMax=end_of_day.isoformat(),
-            singleEvents=True, 
-            orderBy='startTime'
-        ).execute()
-        
-        events = events_result.get('items', [])
+        events = list(_events_between(service, start_of_day, end_of_day, user_timezone_str))
         if not events:
             return f"Your schedule is clear {day_descriptor}! ✨"
 
@@ -119,12 +337,276 @@ def add_event(service, user_timezone_str, summary, start_time_str, end_time_str,
         if conflict: return f"❌ Conflict detected. {conflict}."
         event_body = {'summary': summary, 'location': location, 'description': description or 'Scheduled by FocusFlow', 'start': {'dateTime': start_dt_aware.isoformat()}, 'end': {'dateTime': end_dt_aware.isoformat()}, 'reminders': {'useDefault': True}}
         created_event = service.events().insert(calendarId='primary', body=event_body).execute()
+        mirror = get_event_mirror(service)
+        if mirror is not None:
+            try:
+                mirror.upsert(created_event)
+            except sqlite3.ProgrammingError: pass # evicted meanwhile; the next sync picks the event up
         return (f"✅ Event '{summary}' was successfully added for {start_dt_aware.strftime('%b %d at %I:%M %p')}.")
     except Exception as e: return f"❌ An unexpected error occurred: {e}"
 
+# --- CONFLICT ENGINE ---
+def busy_intervals(service, start_dt, end_dt, user_timezone_str, calendar_ids=('primary',)):
+    """
+    Busy time in [start_dt, end_dt) as a list of (start, end, summary) with aware datetimes, fetched once for the
+    whole span. The primary calendar is read from the local mirror when available; every other calendar in
+    `calendar_ids` (and the primary one without a mirror) is listed with events.list. freebusy.query is not used
+    because tokens only carry the calendar.events scope (see SCOPES), which freebusy rejects.
+    Raises if any requested calendar cannot be read, so callers never mistake a partial answer for free time.
+    """
+    user_tz = pytz.timezone(user_timezone_str)
+    events = []
+    for calendar_id in dict.fromkeys(calendar_ids):
+        mirror = get_event_mirror(service) if calendar_id == 'primary' else None
+        if mirror is not None:
+            try:
+                events += mirror.query(start_dt, end_dt)
+                continue
+            except sqlite3.ProgrammingError: pass # evicted and closed by another thread after the lookup
+        events += _list_events_between(service, start_dt.isoformat(), end_dt.isoformat(), user_timezone_str, calendar_id)
+    return [(start, end, event.get('summary', '(No title)')) for event in events if _blocks_time(event) for start, end in [_event_bounds(event, user_tz)]]
+
+def _blocks_time(event):
+    """False for events that don't block time: marked "free" (transparent) or declined by the user."""
+    if event.get('transparency') == 'transparent': return False
+    return not any(a.get('self') and a.get('responseStatus') == 'declined' for a in event.get('attendees', []))
+
+def sweep_overlaps(candidates, busy):
+    """
+    Sweep-line overlap test of many candidate intervals against busy intervals and against each other, in
+    O((n + m) log(n + m) + k) for k overlaps. `candidates` are (start, end, key) and `busy` (start, end, label).
+    Returns (busy_hits, candidate_hits): key -> list of overlapping busy tuples, key -> set of overlapping keys.
+    Intervals are half-open, so back-to-back events do not conflict.
+    """
+    points = [] # (time, 0 = end before 1 = start at the same instant, kind, index)
+    for n, (start, end, _) in enumerate(candidates):
+        if end > start: points += [(start, 1, 0, n), (end, 0, 0, n)]
+    for n, (start, end, _) in enumerate(busy):
+        if end > start: points += [(start, 1, 1, n), (end, 0, 1, n)]
+    points.sort(key=lambda p: (p[0], p[1]))
+    active_candidates, active_busy = set(), set()
+    busy_hits, candidate_hits = {}, {}
+    for _, is_start, kind, n in points:
+        if not is_start:
+            (active_busy if kind else active_candidates).discard(n)
+        elif kind: # a busy interval opens: it overlaps every candidate still running
+            for c in active_candidates: busy_hits.setdefault(candidates[c][2], []).append(busy[n])
+            active_busy.add(n)
+        else:
+            key = candidates[n][2]
+            if active_busy: busy_hits.setdefault(key, []).extend(busy[b] for b in active_busy)
+            for c in active_candidates:
+                other = candidates[c][2]
+                if other != key:
+                    candidate_hits.setdefault(key, set()).add(other)
+                    candidate_hits.setdefault(other, set()).add(key)
+            active_candidates.add(n)
+    return busy_hits, candidate_hits
+
+def _describe_conflicts(conflicts, user_tz, with_dates=False):
+    """"You already have 'Physics' at 10:00 AM and a busy slot at 02:00 PM scheduled"-style summary of every overlap."""
+    described = []
+    for start, end, summary in sorted(set(conflicts), key=lambda c: c[0]):
+        when = start.astimezone(user_tz).strftime('%b %d at %I:%M %p' if with_dates else '%I:%M %p')
+        described.append(f"'{summary}' at {when}" if summary else f"a busy slot at {when}")
+    if len(described) > 4: described = described[:3] + [f"{len(described) - 3} more"]
+    joined = described[0] if len(described) == 1 else ", ".join(described[:-1]) + f" and {described[-1]}"
+    return f"You already have {joined} scheduled"
+
 def _check_for_conflicts(service, start_time_iso, end_time_iso, user_timezone_str):  # FIXED: Changed user_tz_str to user_timezone_str
     if not service: return "Authentication service not available"
     try:
-        events = service.events().list(calendarId='primary', timeMin=start_time_iso, timeMax=end_time_iso, timeZone=user_timezone_str, singleEvents=True).execute().get('items', [])  # FIXED: Changed user_tz_str to user_timezone_str
-        return f"You already have '{events[0]['summary']}' scheduled" if events else None
-    except Exception: return "Could not check for conflicts."
\ No newline at end of file
+        start_dt, end_dt = dt.datetime.fromisoformat(start_time_iso), dt.datetime.fromisoformat(end_time_iso)
+        busy_hits, _ = sweep_overlaps([(start_dt, end_dt, 0)], busy_intervals(service, start_dt, end_dt, user_timezone_str))
+        return _describe_conflicts(busy_hits[0], pytz.timezone(user_timezone_str)) if busy_hits else None
+    except Exception: return "Could not check for conflicts."
+# --- FREE-SLOT FINDER ---
+def merge_intervals(intervals, buffer=dt.timedelta(0)):
+    """Sorts (start, end, ...) intervals and merges overlapping or touching ones, widening each by `buffer` on both sides."""
+    merged = []
+    for start, end, *_ in sorted(intervals, key=lambda interval: interval[0]):
+        start, end = start - buffer, end + buffer
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]: merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+def free_slots(busy, range_start, range_end, duration, user_tz, work_start=dt.time(9), work_end=dt.time(18), buffer=dt.timedelta(0)):
+    """
+    Gaps of at least `duration` between the busy intervals, inside the daily working window and within
+    [range_start, range_end). Busy intervals are merged once with a sort and sweep, then every day's window is
+    walked with a single forward-only pointer, so the cost is O(m log m + days) for m busy intervals.
+    Returns a list of (start, end) aware datetimes.
+    """
+    merged = merge_intervals(busy, buffer)
+    slots, pointer = [], 0
+    day = range_start.astimezone(user_tz).date()
+    while user_tz.localize(dt.datetime.combine(day, dt.time.min)) < range_end:
+        # Localize each day separately so the working window keeps its wall-clock hours across DST changes.
+        window_start = max(user_tz.localize(dt.datetime.combine(day, work_start)), range_start)
+        window_end = min(user_tz.localize(dt.datetime.combine(day, work_end)), range_end)
+        day += dt.timedelta(days=1)
+        if window_end - window_start < duration: continue
+        while pointer < len(merged) and merged[pointer][1] <= window_start: pointer += 1
+        cursor, scan = window_start, pointer
+        while scan < len(merged) and merged[scan][0] < window_end:
+            if merged[scan][0] - cursor >= duration: slots.append((cursor, merged[scan][0]))
+            cursor = max(cursor, merged[scan][1])
+            scan += 1
+        if window_end - cursor >= duration: slots.append((cursor, window_end))
+    return [(start.astimezone(user_tz), end.astimezone(user_tz)) for start, end in slots]
+
+def find_free_slots(service, user_timezone_str, duration_minutes, start_date_str=None, end_date_str=None, work_start_time="09:00", work_end_time="18:00", buffer_minutes=0, max_results=10, calendar_ids=('primary',)):
+    """
+    Finds free time of at least `duration_minutes` between start_date_str and end_date_str (YYYY-MM-DD,
+    inclusive; defaults to today through the next 6 days) within working hours, keeping `buffer_minutes`
+    clear around existing events. Busy time for the whole range is fetched once per calendar in `calendar_ids`;
+    if any of them cannot be read, an error is returned instead of slots that may be busy there.
+    """
+    if not service: return "Error: Could not connect to Google Calendar."
+    try:
+        user_tz = pytz.timezone(user_timezone_str)
+        now = dt.datetime.now(user_tz)
+        first_day = dt.date.fromisoformat(start_date_str) if start_date_str else now.date()
+        last_day = dt.date.fromisoformat(end_date_str) if end_date_str else first_day + dt.timedelta(days=6)
+        if last_day < first_day: return "❌ The end date is before the start date."
+        range_start = max(user_tz.localize(dt.datetime.combine(first_day, dt.time.min)), now)
+        range_end = user_tz.localize(dt.datetime.combine(last_day + dt.timedelta(days=1), dt.time.min))
+        duration = dt.timedelta(minutes=int(duration_minutes))
+        if range_end <= range_start: return "That time range is already in the past."
+
+        busy = busy_intervals(service, range_start, range_end, user_timezone_str, calendar_ids)
+        slots = free_slots(busy, range_start, range_end, duration, user_tz, dt.time.fromisoformat(work_start_time), dt.time.fromisoformat(work_end_time), dt.timedelta(minutes=int(buffer_minutes or 0)))
+        span = f"between {first_day.strftime('%b %d')} and {last_day.strftime('%b %d')}"
+        if not slots: return f"I couldn't find {int(duration_minutes)} free minutes {span} within {work_start_time}-{work_end_time}."
+        lines = [f"- {start.strftime('%a %b %d')}: {start.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}" for start, end in slots[:int(max_results)]]
+        more = f"\n...and {len(slots) - int(max_results)} more." if len(slots) > int(max_results) else ""
+        return f"Free slots of at least {int(duration_minutes)} minutes {span}:\n" + "\n".join(lines) + more
+    except Exception as e:
+        return f"A system error occurred while finding free time: {e}"
+
+# --- BULK IMPORT (Timetable Manager) ---
+BATCH_MAX_REQUESTS = 50 # Google recommends at most 50 calls per Calendar batch request
+
+def _event_bounds(event, user_tz):
+    """(start, end) of an API event as aware datetimes; all-day events span whole days in the user's timezone."""
+    def parse(value):
+        if 'dateTime' in value: return dt.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+        return user_tz.localize(dt.datetime.combine(dt.date.fromisoformat(value['date']), dt.time.min))
+    return parse(event['start']), parse(event['end'])
+
+# Only what the day views and conflict checks read, which shrinks each page considerably.
+EVENT_LIST_FIELDS = "items(id,summary,start,end,transparency,attendees(self,responseStatus)),nextPageToken"
+
+def iter_events(service, time_min_iso, time_max_iso, user_timezone_str, page_size=250, calendar_id='primary'):
+    """Yields events overlapping [time_min, time_max) ordered by start, requesting the next page only when it is needed."""
+    page_token = None
+    while True:
+        result = service.events().list(calendarId=calendar_id, timeMin=time_min_iso, timeMax=time_max_iso, timeZone=user_timezone_str, singleEvents=True, orderBy='startTime', maxResults=page_size, pageToken=page_token, fields=EVENT_LIST_FIELDS).execute()
+        yield from result.get('items', [])
+        page_token = result.get('nextPageToken')
+        if not page_token: return
+
+def _list_events_between(service, time_min_iso, time_max_iso, user_timezone_str, calendar_id='primary'):
+    return list(iter_events(service, time_min_iso, time_max_iso, user_timezone_str, page_size=2500, calendar_id=calendar_id))
+
+def weekly_recurrence(start_dt_naive, until_date, user_timezone_str, exdates=()):
+    """
+    RFC 5545 recurrence lines for a class repeating weekly from `start_dt_naive` (local time) through
+    `until_date`, skipping the dates in `exdates` (holidays). UNTIL is given in UTC, as the spec requires for
+    events with a TZID start. Returns (recurrence, occurrences) where occurrences are the local start datetimes.
+    """
+    user_tz = pytz.timezone(user_timezone_str)
+    skipped = set(exdates)
+    weeks = max(0, (until_date - start_dt_naive.date()).days // 7 + 1)
+    all_starts = [start_dt_naive + dt.timedelta(weeks=k) for k in range(weeks)]
+    until_utc = user_tz.localize(dt.datetime.combine(until_date, dt.time.max)).astimezone(pytz.utc)
+    recurrence = [f"RRULE:FREQ=WEEKLY;UNTIL={until_utc.strftime('%Y%m%dT%H%M%SZ')}"]
+    excluded = [d for d in all_starts if d.date() in skipped]
+    if excluded: recurrence.append(f"EXDATE;TZID={user_timezone_str}:" + ",".join(d.strftime('%Y%m%dT%H%M%S') for d in excluded))
+    return recurrence, [d for d in all_starts if d.date() not in skipped]
+
+def add_events_bulk(service, user_timezone_str, events, on_progress=None, chunk_size=BATCH_MAX_REQUESTS):
+    """
+    Adds many events at once. `events` is a list of dicts with the keyword arguments of add_event
+    (summary, start_time_str, end_time_str, optional description/location). Semester mode: a row with
+    `recurrence_until` (a date) becomes one weekly recurring event ending on that date, and its optional
+    `exdates` (dates, e.g. holidays) are excluded, so a whole term costs one insert per class.
+    Conflicts are checked with one busy_intervals lookup over the whole span (the local mirror, or events.list),
+    covering every occurrence and earlier rows of the same import, and the inserts go out as batch HTTP requests of `chunk_size` calls each, so a
+    40-class timetable costs 2 requests instead of 80. `on_progress(done, total)` is called once per chunk.
+    Returns one result string per input row, in the same format as add_event.
+    """
+    if not service: return ["Error: Could not connect to Google Calendar."] * len(events)
+    results = [None] * len(events)
+    pending = [] # (row index, [(start, end) per occurrence], body)
+    try:
+        user_tz = pytz.timezone(user_timezone_str)
+    except Exception as e:
+        return [f"❌ An unexpected error occurred: {e}"] * len(events)
+    for i, event in enumerate(events):
+        try:
+            start_dt_naive = dt.datetime.fromisoformat(event['start_time_str'])
+            duration = dt.datetime.fromisoformat(event['end_time_str']) - start_dt_naive
+            start_dt_aware = user_tz.localize(start_dt_naive)
+            end_dt_aware = user_tz.localize(start_dt_naive + duration)
+            body = {'summary': event['summary'], 'location': event.get('location'), 'description': event.get('description') or 'Scheduled by FocusFlow', 'start': {'dateTime': start_dt_aware.isoformat()}, 'end': {'dateTime': end_dt_aware.isoformat()}, 'reminders': {'useDefault': True}}
+            if event.get('recurrence_until'):
+                body['recurrence'], starts = weekly_recurrence(start_dt_naive, event['recurrence_until'], user_timezone_str, event.get('exdates', ()))
+                if not starts: raise ValueError("no classes fall inside the semester")
+                # Recurring events need an explicit time zone so they keep their local time across DST changes.
+                body['start']['timeZone'] = body['end']['timeZone'] = user_timezone_str
+                occurrences = [(user_tz.localize(d), user_tz.localize(d + duration)) for d in starts]
+            else:
+                occurrences = [(start_dt_aware, end_dt_aware)]
+            pending.append((i, occurrences, body))
+        except Exception as e: results[i] = f"❌ An unexpected error occurred: {e}"
+    if not pending: return results
+
+    # One busy-time fetch for the whole span, then one sweep over every occurrence of every row.
+    try:
+        time_min = min(o[0][0] for _, o, _ in pending)
+        time_max = max(o[-1][1] for _, o, _ in pending)
+        busy = busy_intervals(service, time_min, time_max, user_timezone_str)
+    except Exception:
+        for i, _, _ in pending: results[i] = "❌ Conflict detected. Could not check for conflicts."
+        return results
+    busy_hits, candidate_hits = sweep_overlaps([(start, end, i) for i, occurrences, _ in pending for start, end in occurrences], busy)
+    to_insert, accepted = [], set()
+    for i, occurrences, body in pending:
+        # Rows of the same import block each other in order: a row clashing with an earlier accepted row is skipped.
+        clashing_rows = sorted(candidate_hits.get(i, set()) & accepted)
+        if i in busy_hits:
+            results[i] = f"❌ Conflict detected. {_describe_conflicts(busy_hits[i], user_tz, with_dates=len(occurrences) > 1)}."
+        elif clashing_rows:
+            results[i] = "❌ Conflict detected. It overlaps " + " and ".join(f"'{events[r]['summary']}'" for r in clashing_rows) + " from this import."
+        else:
+            accepted.add(i)
+            to_insert.append((i, occurrences, body))
+
+    def on_inserted(request_id, response, exception):
+        occurrences, summary = labels[request_id]
+        i = int(request_id)
+        if exception is not None: results[i] = f"❌ An unexpected error occurred: {exception}"
+        elif len(occurrences) > 1: results[i] = f"✅ Weekly event '{summary}' was successfully added: {len(occurrences)} classes from {occurrences[0][0].strftime('%b %d')} to {occurrences[-1][0].strftime('%b %d')} at {occurrences[0][0].strftime('%I:%M %p')}."
+        else: results[i] = f"✅ Event '{summary}' was successfully added for {occurrences[0][0].strftime('%b %d at %I:%M %p')}."
+
+    done = len(events) - len(to_insert)
+    if on_progress: on_progress(done, len(events))
+    mirror = get_event_mirror(service) if to_insert else None
+    for chunk_start in range(0, len(to_insert), chunk_size):
+        chunk = to_insert[chunk_start:chunk_start + chunk_size]
+        labels = {str(i): (occurrences, body['summary']) for i, occurrences, body in chunk}
+        batch = service.new_batch_http_request(callback=on_inserted)
+        for i, _, body in chunk:
+            batch.add(service.events().insert(calendarId='primary', body=body), request_id=str(i))
+        try:
+            batch.execute()
+        except Exception as e:
+            for i, _, _ in chunk: results[i] = results[i] or f"❌ An unexpected error occurred: {e}"
+        # Recurring series are expanded by the server, so let the next read pick the new instances up as deltas.
+        if mirror is not None: mirror.mark_stale()
+        done += len(chunk)
+        if on_progress: on_progress(done, len(events))
+    return results
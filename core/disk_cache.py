@@ -0,0 +1,86 @@
+# core/disk_cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class DiskLRUCache:
+    """
+    Small persistent key -> bytes cache backed by SQLite.
+    Entries expire after `ttl_seconds` and the least recently used ones are evicted once the stored values
+    exceed `max_bytes`. A bounded in-memory LRU sits in front, so repeated hits never touch the disk.
+    Safe to share between threads; several processes may also share the same file.
+    """
+
+    def __init__(self, db_path, max_bytes=50 * 1024 * 1024, ttl_seconds=30 * 24 * 3600, memory_items=256):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_items = memory_items
+        self._memory = OrderedDict() # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+        self.stats = {"hits": 0, "memory_hits": 0, "misses": 0, "evictions": 0}
+
+    def _remember(self, key, value, stored_at):
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items: self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached bytes for `key`, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and now - cached[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1; self.stats["memory_hits"] += 1
+                return cached[0]
+            row = self._db.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None: self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            value = bytes(row[0])
+            self._remember(key, value, row[1])
+            self.stats["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO cache (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)", (key, value, len(value), now, now))
+            self._remember(key, value, now)
+            self._evict(now)
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM cache WHERE stored_at < ?", (now - self.ttl_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes: return
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes: break
+            evicted.append((key,)); total -= size
+            self._memory.pop(key, None)
+        self._db.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        self.stats["evictions"] += len(evicted)
+
+    def info(self):
+        """Hit/miss counters plus the current number of entries and bytes on disk."""
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "entries": entries, "bytes": size, "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None}
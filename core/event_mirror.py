@@ -0,0 +1,172 @@
+# core/event_mirror.py
+import bisect
+import datetime as dt
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytz
+from googleapiclient.errors import HttpError
+
+MIRROR_DIR = os.environ.get("CALENDAR_MIRROR_DIR", os.path.join("data", "event_mirrors"))
+# Reads within this many seconds of the last sync are answered without asking the API for deltas.
+MIRROR_SYNC_INTERVAL_SECONDS = float(os.environ.get("CALENDAR_MIRROR_SYNC_SECONDS", 15))
+SYNC_FIELDS = "items(id,status,summary,start,end,transparency,attendees(self,responseStatus)),nextPageToken,nextSyncToken,timeZone"
+# Bumped whenever the stored event fields change; older mirror files are then rebuilt with a full resync.
+MIRROR_SCHEMA_VERSION = "2"
+
+class EventMirror:
+    """
+    Local copy of one user's calendar, kept in SQLite and current through the Calendar API's incremental sync.
+    The first sync lists every event once; later syncs send the stored `syncToken` and only receive what
+    changed. A 410 Gone (expired token) wipes the mirror and falls back to a full resync.
+    Events are held in memory in an interval index sorted by start time, so a day view or conflict check is a
+    bisect plus a short scan. Several processes may share one mirror file; each notices the others' writes
+    through `PRAGMA data_version` and reloads its index.
+    """
+
+    def __init__(self, db_path, calendar_id='primary', sync_interval=MIRROR_SYNC_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.calendar_id = calendar_id
+        self.sync_interval = sync_interval
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS events (
+            id TEXT PRIMARY KEY,
+            start_ts REAL NOT NULL,
+            end_ts REAL NOT NULL,
+            data TEXT NOT NULL)""")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if self._meta('schema_version') != MIRROR_SCHEMA_VERSION:
+            self._db.execute("DELETE FROM meta WHERE key IN ('sync_token', 'synced_at')")
+            self._set_meta('schema_version', MIRROR_SCHEMA_VERSION)
+        self._lock = threading.RLock()
+        self._stale = False
+        self._data_version = None
+        self._starts = [] # sorted start timestamps
+        self._entries = [] # (start_ts, end_ts, event) in the same order as _starts
+        self._max_duration = 0.0
+        self.stats = {"full_syncs": 0, "incremental_syncs": 0, "skipped_syncs": 0, "changes_applied": 0, "queries": 0}
+
+    # --- STORAGE ---
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _timestamp(self, value, calendar_tz):
+        if 'dateTime' in value: return dt.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00')).timestamp()
+        return calendar_tz.localize(dt.datetime.combine(dt.date.fromisoformat(value['date']), dt.time.min)).timestamp()
+
+    def _apply(self, items, calendar_tz):
+        """Upserts or deletes a page of events. Must be called inside a transaction."""
+        for event in items:
+            if event.get('status') == 'cancelled' or 'start' not in event:
+                self._db.execute("DELETE FROM events WHERE id = ?", (event['id'],))
+                continue
+            data = {'id': event['id'], 'summary': event.get('summary', '(No title)'), 'start': event['start'], 'end': event['end']}
+            # Kept so busy-time lookups can skip events that don't block time (free or declined).
+            if event.get('transparency'): data['transparency'] = event['transparency']
+            if any(a.get('self') for a in event.get('attendees', [])): data['attendees'] = [a for a in event['attendees'] if a.get('self')]
+            self._db.execute("INSERT OR REPLACE INTO events (id, start_ts, end_ts, data) VALUES (?, ?, ?, ?)",
+                (event['id'], self._timestamp(event['start'], calendar_tz), self._timestamp(event['end'], calendar_tz), json.dumps(data)))
+        self.stats["changes_applied"] += len(items)
+
+    def _load_index(self):
+        rows = self._db.execute("SELECT start_ts, end_ts, data FROM events ORDER BY start_ts").fetchall()
+        self._entries = [(start, end, json.loads(data)) for start, end, data in rows]
+        self._starts = [entry[0] for entry in self._entries]
+        self._max_duration = max((end - start for start, end, _ in self._entries), default=0.0)
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _validate_index(self):
+        if self._data_version != self._db.execute("PRAGMA data_version").fetchone()[0]: self._load_index()
+
+    # --- SYNC ---
+    def _list_pages(self, service, sync_token):
+        page_token = None
+        while True:
+            params = {'calendarId': self.calendar_id, 'singleEvents': True, 'maxResults': 2500, 'fields': SYNC_FIELDS, 'pageToken': page_token}
+            if sync_token: params['syncToken'] = sync_token
+            page = service.events().list(**params).execute()
+            yield page
+            page_token = page.get('nextPageToken')
+            if not page_token: return
+
+    def _sync_from(self, service, sync_token):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if not sync_token: self._db.execute("DELETE FROM events")
+            for page in self._list_pages(service, sync_token):
+                if page.get('timeZone'): self._set_meta('time_zone', page['timeZone'])
+                self._apply(page.get('items', []), pytz.timezone(self._meta('time_zone') or 'UTC'))
+                if page.get('nextSyncToken'): self._set_meta('sync_token', page['nextSyncToken'])
+            self._set_meta('synced_at', time.time())
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def sync(self, service, force=False):
+        """Brings the mirror up to date: a full listing the first time, only the changes afterwards."""
+        with self._lock:
+            synced_at = float(self._meta('synced_at') or 0)
+            if not force and not self._stale and time.time() - synced_at < self.sync_interval:
+                self.stats["skipped_syncs"] += 1
+            else:
+                sync_token = self._meta('sync_token')
+                try:
+                    self._sync_from(service, sync_token)
+                    self.stats["incremental_syncs" if sync_token else "full_syncs"] += 1
+                except HttpError as e:
+                    if not sync_token or e.resp.status != 410: raise
+                    # The sync token expired or was invalidated by the server: start over from a full listing.
+                    self._sync_from(service, None)
+                    self.stats["full_syncs"] += 1
+                self._stale = False
+                self._load_index()
+            self._validate_index()
+
+    def mark_stale(self):
+        """Forces the next read to fetch deltas, e.g. after creating an event the mirror can't model locally."""
+        self._stale = True
+
+    def upsert(self, event):
+        """Write-through for an event this process just created, so it is visible before the next sync."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._apply([event], pytz.timezone(self._meta('time_zone') or 'UTC'))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._load_index()
+
+    # --- QUERIES ---
+    def query(self, start_dt, end_dt):
+        """Events overlapping [start_dt, end_dt), ordered by start time."""
+        start_ts, end_ts = start_dt.timestamp(), end_dt.timestamp()
+        with self._lock:
+            self._validate_index()
+            self.stats["queries"] += 1
+            # Nothing that starts earlier than (start - longest event) can still be running at `start`.
+            lo = bisect.bisect_left(self._starts, start_ts - self._max_duration)
+            hi = bisect.bisect_left(self._starts, end_ts)
+            return [event for s, e, event in self._entries[lo:hi] if e > start_ts]
+
+    def close(self):
+        """Closes the database connection and drops the in-memory index. Later calls fail; reopen a new EventMirror instead."""
+        with self._lock:
+            self._db.close()
+            self._entries, self._starts = [], []
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "events": len(self._entries), "synced_at": self._meta('synced_at')}
@@ -0,0 +1,105 @@
+# core/speech_backends.py
+import io
+import os
+import threading
+
+import numpy as np
+
+# Optional dependencies for the offline backend: `pip install faster-whisper av`
+try:
+    import av
+except ImportError:
+    av = None
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
+SAMPLE_RATE = 16000
+SPEECH_BACKEND = os.environ.get("SPEECH_BACKEND", "google") # "google" (Cloud Speech-to-Text) or "local"
+LOCAL_MODEL_SIZE = os.environ.get("LOCAL_SPEECH_MODEL", "base.en")
+LOCAL_CPU_THREADS = int(os.environ.get("LOCAL_SPEECH_THREADS", 4))
+
+def decode_audio(audio_bytes, sample_rate=SAMPLE_RATE):
+    """Decodes any container/codec PyAV understands (OGG/Opus voice notes, WAV mic captures) to mono float32 PCM."""
+    if av is None: raise RuntimeError("Decoding audio requires PyAV: pip install av")
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+    chunks = []
+    with av.open(io.BytesIO(audio_bytes)) as container:
+        for frame in container.decode(audio=0):
+            chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(frame))
+        chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(None)) # flush
+    return np.concatenate(chunks).astype(np.float32) if chunks else np.zeros(0, dtype=np.float32)
+
+class SpeechBackend:
+    """Interface for speech recognizers. `encoding` is "ogg_opus" (Telegram voice notes) or "wav" (mic captures)."""
+    name = "base"
+    supports_streaming = False
+
+    def transcribe(self, audio_bytes, encoding="ogg_opus"):
+        raise NotImplementedError
+
+class GoogleCloudSpeechBackend(SpeechBackend):
+    """Google Cloud Speech-to-Text with one shared client; one network round trip per utterance."""
+    name = "google"
+    supports_streaming = True
+
+    def __init__(self, language_code="en-US"):
+        self.language_code = language_code
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google.cloud import speech
+                self._client = speech.SpeechClient()
+        return self._client
+
+    def recognition_config(self, encoding="ogg_opus", sample_rate_hertz=SAMPLE_RATE):
+        # Telegram voice notes are encoded in OGG format with the Opus codec (re-encoded at 16 kHz after silence
+        # trimming); mic captures are 16-bit WAV.
+        from google.cloud import speech
+        audio_encoding = speech.RecognitionConfig.AudioEncoding.OGG_OPUS if encoding == "ogg_opus" else speech.RecognitionConfig.AudioEncoding.LINEAR16
+        return speech.RecognitionConfig(encoding=audio_encoding, sample_rate_hertz=sample_rate_hertz, language_code=self.language_code)
+
+    def transcribe(self, audio_bytes, encoding="ogg_opus"):
+        from google.cloud import speech
+        response = self.client().recognize(config=self.recognition_config(encoding), audio=speech.RecognitionAudio(content=audio_bytes))
+        if not response.results or not response.results[0].alternatives: return None
+        return response.results[0].alternatives[0].transcript
+
+class LocalWhisperBackend(SpeechBackend):
+    """
+    CPU-only recognizer built on faster-whisper (CTranslate2, int8). The model is loaded once per process
+    and warmed up with a short silent clip, so every later call has predictable, network-free latency.
+    """
+    name = "local"
+
+    def __init__(self, model_size=LOCAL_MODEL_SIZE, cpu_threads=LOCAL_CPU_THREADS, language="en"):
+        if WhisperModel is None: raise RuntimeError("The local speech backend requires faster-whisper: pip install faster-whisper av")
+        self.language = language
+        self._model = WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+        self._lock = threading.Lock() # one decode at a time; cpu_threads already parallelizes each call
+        self.transcribe_pcm(np.zeros(SAMPLE_RATE // 2, dtype=np.float32))
+
+    def transcribe_pcm(self, samples):
+        """Transcribes mono float32 PCM at 16 kHz."""
+        with self._lock:
+            segments, _ = self._model.transcribe(samples, language=self.language, beam_size=1, condition_on_previous_text=False)
+            text = " ".join(segment.text.strip() for segment in segments).strip()
+        return text or None
+
+    def transcribe(self, audio_bytes, encoding="ogg_opus"):
+        return self.transcribe_pcm(decode_audio(audio_bytes))
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Returns the process-wide backend selected by SPEECH_BACKEND, created (and warmed up) on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalWhisperBackend() if SPEECH_BACKEND == "local" else GoogleCloudSpeechBackend()
+    return _backend
@@ -1,39 +1,249 @@
 # core/timetable_parser.py
 import streamlit as st
 import google.generativeai as genai
-from PIL import Image
+from PIL import Image, ImageChops, ImageOps
+import hashlib
 import io
 import json
+import os
+import queue
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-# This function should be in its own file: core/timetable_parser.py
+import pandas as pd
+
+# PDF timetables are rasterized with PyMuPDF: `pip install pymupdf`
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+from core.disk_cache import DiskLRUCache
+
+MODEL_NAME = 'gemini-1.5-flash-latest'
+# A timetable stays legible for OCR at ~1600 px on the long edge; phone photos are 3-4x that.
+MAX_IMAGE_EDGE = int(os.environ.get("TIMETABLE_MAX_IMAGE_EDGE", 1600))
+JPEG_QUALITY = 85
+# Pages are parsed concurrently; each worker holds one Gemini stream open.
+PARSE_WORKERS = int(os.environ.get("TIMETABLE_PARSE_WORKERS", 4))
+MAX_PDF_PAGES = 20
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SCHEDULE_COLUMNS = ["day", "subject", "start_time", "end_time"]
+
+# Simplified prompt - the response schema enforces the shape and the validation code handles the rest
+PROMPT = """
+You are an expert timetable parser. Analyze the provided image of a class schedule.
+For each class, extract the day, subject, start time, and end time.
+Times must be in 24-hour HH:MM format.
+"""
+
+# Constrained decoding: Gemini can only emit JSON of this shape, so there are no code fences or prose to strip.
+SCHEDULE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "schedule": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "day": {"type": "string", "format": "enum", "enum": DAYS},
+                    "subject": {"type": "string"},
+                    "start_time": {"type": "string", "description": "24-hour HH:MM"},
+                    "end_time": {"type": "string", "description": "24-hour HH:MM"},
+                },
+                "required": SCHEDULE_COLUMNS,
+            },
+        },
+    },
+    "required": ["schedule"],
+}
+GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": SCHEDULE_SCHEMA, "temperature": 0}
+
+# --- RESULT CACHE ---
+# Parsed replies are keyed by the hash of the uploaded bytes and of the preprocessed image (plus model and prompt),
+# so pressing "Extract Schedule" again, or re-uploading the same photo, returns without a Gemini call.
+parse_cache = DiskLRUCache(
+    os.environ.get("TIMETABLE_CACHE_DB", os.path.join("data", "timetables.db")),
+    max_bytes=int(os.environ.get("TIMETABLE_CACHE_MAX_BYTES", 10 * 1024 * 1024)),
+    ttl_seconds=int(os.environ.get("TIMETABLE_CACHE_TTL_SECONDS", 180 * 24 * 3600)),
+)
+_REQUEST_FINGERPRINT = hashlib.sha256(f"{MODEL_NAME}\0{PROMPT}\0{json.dumps(SCHEDULE_SCHEMA, sort_keys=True)}".encode("utf-8")).hexdigest()[:16]
+
+def _cache_key(image_hash):
+    return f"{_REQUEST_FINGERPRINT}:{image_hash}"
+
+def preprocess_timetable_image(image_bytes, max_edge=MAX_IMAGE_EDGE):
+    """
+    Prepares a photo or screenshot for OCR: applies the EXIF orientation, crops the uniform border,
+    converts to grayscale and downsizes so the long edge is at most `max_edge` pixels.
+    Returns (jpeg_bytes, stats).
+    """
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    original_size = img.size
+    img = img.convert("L")
+    # Crop margins that match the corner pixel (scanner borders, screenshot padding); small noise is ignored.
+    background = Image.new("L", img.size, img.getpixel((0, 0)))
+    bbox = ImageChops.difference(img, background).point(lambda p: 255 if p > 24 else 0).getbbox()
+    if bbox and (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) < img.size[0] * img.size[1]:
+        img = img.crop(bbox)
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    img = ImageOps.autocontrast(img, cutoff=1)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    processed = buffer.getvalue()
+    return processed, {"original_size": original_size, "size": img.size, "input_bytes": len(image_bytes), "output_bytes": len(processed)}
+
+class ScheduleRowParser:
+    """
+    Incremental parser for a streamed {"schedule": [{...}, ...]} reply. `feed` takes the next text chunk and
+    returns every row object completed by it, so rows can be shown while the model is still generating.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._row_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        rows = []
+        for i in range(self._pos, len(self.text)):
+            c = self.text[i]
+            if self._in_string:
+                if self._escaped: self._escaped = False
+                elif c == "\\": self._escaped = True
+                elif c == '"': self._in_string = False
+            elif c == '"': self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+                # depth 1 is the outer object, 2 the schedule array, 3 a row
+                if c == "{" and self._depth == 3: self._row_start = i
+            elif c in "}]":
+                if c == "}" and self._depth == 3 and self._row_start is not None:
+                    try:
+                        rows.append(json.loads(self.text[self._row_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass # left for validate_schedule to report via the full reply
+                    self._row_start = None
+                self._depth -= 1
+        self._pos = len(self.text)
+        return rows
+
+def validate_schedule(rows):
+    """
+    Normalizes and checks extracted rows with vectorized pandas operations: the day must be a weekday name,
+    times must be H:MM/HH:MM (normalized to HH:MM) and each class must end after it starts.
+    Returns (valid_df, rejected_df); rejected rows carry an "issue" column explaining why.
+    """
+    df = pd.DataFrame(rows, columns=SCHEDULE_COLUMNS).astype("string").apply(lambda col: col.str.strip())
+    df["day"] = df["day"].str.capitalize()
+    issue = pd.Series(pd.NA, index=df.index, dtype="string")
+    minutes = {}
+    for col in ("start_time", "end_time"):
+        parts = df[col].str.extract(r"^(\d{1,2})[:.](\d{2})$").astype("Float64")
+        ok = parts[0].between(0, 23) & parts[1].between(0, 59)
+        issue = issue.mask(issue.isna() & ~ok.fillna(False), f"{col} is not a valid HH:MM time")
+        minutes[col] = parts[0] * 60 + parts[1]
+        df[col] = parts[0].astype("Int64").astype("string").str.zfill(2) + ":" + parts[1].astype("Int64").astype("string").str.zfill(2)
+    issue = issue.mask(issue.isna() & ~(minutes["end_time"] > minutes["start_time"]).fillna(False), "end_time is not after start_time")
+    issue = issue.mask(~df["day"].isin(DAYS).fillna(False), "day is not a weekday name")
+    issue = issue.mask(df["subject"].fillna("").eq(""), "subject is missing")
+    valid = issue.isna()
+    rejected = df[~valid].assign(issue=issue[~valid])
+    return df[valid].astype(object).reset_index(drop=True), rejected.reset_index(drop=True)
+
+def deduplicate_schedule(df):
+    """Drops classes that appear more than once (overlapping photos, a table repeated across PDF pages)."""
+    key = df["subject"].astype(str).str.casefold().str.split().str.join(" ")
+    duplicated = pd.DataFrame({"day": df["day"], "subject": key, "start_time": df["start_time"], "end_time": df["end_time"]}).duplicated()
+    return df[~duplicated].reset_index(drop=True)
+
+def rasterize_upload(file_bytes, filename):
+    """
+    Turns one uploaded file into a list of page images (bytes). Images pass through unchanged; PDF pages are
+    rendered in grayscale at a scale where the long edge matches MAX_IMAGE_EDGE, so nothing is rendered only
+    to be downsized again.
+    """
+    if not filename.lower().endswith(".pdf"): return [file_bytes]
+    if fitz is None: raise RuntimeError("Reading PDF timetables requires PyMuPDF: pip install pymupdf")
+    pages = []
+    with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+        for page in doc.pages(0, min(doc.page_count, MAX_PDF_PAGES)):
+            scale = MAX_IMAGE_EDGE / max(page.rect.width, page.rect.height)
+            pages.append(page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY).tobytes("png"))
+    return pages
+
+def _cached_reply(image_bytes):
+    """Returns (reply_text_or_None, processed_bytes, cache_keys) for an upload."""
+    upload_key = _cache_key(hashlib.sha256(image_bytes).hexdigest())
+    cached = parse_cache.get(upload_key)
+    if cached is not None: return cached.decode("utf-8"), image_bytes, [upload_key]
+    try:
+        processed_bytes, _ = preprocess_timetable_image(image_bytes)
+    except Exception as e:
+        print(f"Timetable image preprocessing failed, sending the original image: {e}")
+        processed_bytes = image_bytes
+    # The same picture re-encoded or re-exported usually preprocesses to identical bytes.
+    processed_key = _cache_key(hashlib.sha256(processed_bytes).hexdigest())
+    cached = parse_cache.get(processed_key)
+    if cached is not None:
+        parse_cache.set(upload_key, cached)
+        return cached.decode("utf-8"), processed_bytes, [upload_key]
+    return None, processed_bytes, [upload_key, processed_key]
+
+def stream_timetable_rows(image_bytes):
+    """
+    Parses a timetable image with Gemini 1.5 Flash using schema-constrained JSON output and yields lists of
+    row dicts as they are completed in the streamed reply. Cached images yield all rows at once.
+    Raises on API errors or a reply that is not valid JSON.
+    """
+    cached, processed_bytes, cache_keys = _cached_reply(image_bytes)
+    if cached is not None:
+        yield json.loads(cached).get("schedule", [])
+        return
+    genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+    model = genai.GenerativeModel(MODEL_NAME, generation_config=GENERATION_CONFIG)
+    parser = ScheduleRowParser()
+    for chunk in model.generate_content([PROMPT, Image.open(io.BytesIO(processed_bytes))], stream=True):
+        rows = parser.feed(chunk.text)
+        if rows: yield rows
+    json.loads(parser.text) # a truncated or malformed reply is an error, not a silently short schedule
+    for key in cache_keys: parse_cache.set(key, parser.text.encode("utf-8"))
+
+_parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="timetable-parse")
+
+def stream_timetable_pages(page_images):
+    """
+    Parses several page images concurrently on a bounded worker pool and yields (page_index, rows, error)
+    as rows arrive from any page, so total wall time stays close to that of the slowest single page.
+    Each page ends with one item whose rows is None; error is the exception if that page failed.
+    """
+    events = queue.Queue()
+
+    def parse_page(index, image_bytes):
+        try:
+            for rows in stream_timetable_rows(image_bytes): events.put((index, rows, None))
+            events.put((index, None, None))
+        except Exception as e:
+            events.put((index, None, e))
+
+    for index, image_bytes in enumerate(page_images):
+        _parse_executor.submit(parse_page, index, image_bytes)
+    remaining = len(page_images)
+    while remaining:
+        item = events.get()
+        if item[1] is None: remaining -= 1
+        yield item
 
 def parse_timetable_image(image_bytes):
     """Uses Gemini 1.5 Flash to parse a timetable image and return structured JSON."""
     try:
-        genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        img = Image.open(io.BytesIO(image_bytes))
-
-        # Simplified prompt - let the validation code handle the rest
-        prompt = """
-        You are an expert timetable parser. Analyze the provided image of a class schedule.
-        For each class, extract the day, subject, start time, and end time.
-        Return the result ONLY as a valid JSON object with a single key "schedule" which is a list of objects.
-        Each object must have the keys: "day", "subject", "start_time", "end_time".
-        Times must be in 24-hour HH:MM format.
-        
-        Example:
-        {
-          "schedule": [
-            { "day": "Monday", "subject": "Physics", "start_time": "09:00", "end_time": "10:00" }
-          ]
-        }
-        """
-        
-        response = model.generate_content([prompt, img])
-        return response.text
-            
+        rows = [row for batch in stream_timetable_rows(image_bytes) for row in batch]
+        return json.dumps({"schedule": rows})
     except Exception as e:
         st.error(f"An error occurred during image parsing: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,35 +1,134 @@
 # core/transcriber.py
+import hashlib
+import os
 import requests
+from requests.adapters import HTTPAdapter
 from google.cloud import speech
 
-def transcribe_telegram_voice_note(file_url):
-    """Downloads a Telegram audio file and transcribes it using Google Cloud Speech-to-Text."""
-    try:
-        # Download the audio file from Telegram's temporary URL
-        response = requests.get(file_url)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        audio_content = response.content
+from core import speech_backends, voice_activity
+from core.disk_cache import DiskLRUCache
+
+DOWNLOAD_CHUNK_BYTES = 32 * 1024
+# streaming_recognize rejects requests carrying more than ~25 KB of audio, so download chunks are split to this size.
+STREAMING_REQUEST_MAX_BYTES = 16 * 1024
+# The synchronous recognize API rejects inline audio longer than ~60 seconds or over 10 MB.
+SYNC_RECOGNIZE_MAX_BYTES = 10 * 1024 * 1024
+SYNC_RECOGNIZE_MAX_SECONDS = 55
+# Trim silence (VAD) and re-encode voice notes before recognition. Needs PyAV; on by default when it is installed.
+AUDIO_PREPROCESSING = os.environ.get("AUDIO_PREPROCESSING", "1" if speech_backends.av else "0") == "1"
+
+# --- TRANSCRIPT CACHE ---
+# Forwarded or retried voice notes are answered from here instead of paying for another Speech-to-Text call.
+# Transcripts are keyed both by Telegram's file_unique_id and by a SHA-256 of the audio bytes.
+transcript_cache = DiskLRUCache(
+    os.environ.get("TRANSCRIPT_CACHE_DB", os.path.join("data", "transcripts.db")),
+    max_bytes=int(os.environ.get("TRANSCRIPT_CACHE_MAX_BYTES", 20 * 1024 * 1024)),
+    ttl_seconds=int(os.environ.get("TRANSCRIPT_CACHE_TTL_SECONDS", 30 * 24 * 3600)),
+)
 
-        # Initialize the Google Speech client
-        client = speech.SpeechClient()
+def get_cached_transcript(file_unique_id):
+    """Returns a cached transcript for a Telegram file, without downloading anything, or None."""
+    cached = transcript_cache.get(f"file:{file_unique_id}") if file_unique_id else None
+    return cached.decode("utf-8") if cached is not None else None
 
-        audio = speech.RecognitionAudio(content=audio_content)
-        # Telegram voice notes are encoded in OGG format with the Opus codec.
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
-            sample_rate_hertz=16000, # This is a standard for Telegram voice notes
-            language_code="en-US",   # Or specify other languages if needed
-        )
+def _cache_transcript(transcript, file_unique_id, content_hash):
+    if not transcript: return
+    value = transcript.encode("utf-8")
+    if file_unique_id: transcript_cache.set(f"file:{file_unique_id}", value)
+    if content_hash: transcript_cache.set(f"sha256:{content_hash}", value)
 
-        # Performs speech recognition on the audio file
-        response = client.recognize(config=config, audio=audio)
+def cache_stats():
+    return transcript_cache.info()
 
-        if not response.results or not response.results[0].alternatives:
-            return None # Return None if no transcription could be made
+# --- SHARED CLIENTS ---
+# One recognizer backend (see core/speech_backends.py) and one pooled HTTP session per process, reused by every voice note.
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+def _recognize_buffered(audio_content):
+    """Single recognize call on audio that is already in memory, with whichever backend is configured."""
+    return speech_backends.get_backend().transcribe(audio_content, encoding="ogg_opus")
+
+def _recognize_preprocessed(audio_content):
+    """Cuts silence out of a downloaded voice note and recognizes only the voiced audio."""
+    backend = speech_backends.get_backend()
+    try:
+        if hasattr(backend, "transcribe_pcm"):
+            # Local engines take PCM directly, so skip the re-encode.
+            trimmed = voice_activity.trim_silence(speech_backends.decode_audio(audio_content))
+            return backend.transcribe_pcm(trimmed) if trimmed.size else None
+        processed, stats = voice_activity.preprocess_voice_note(audio_content)
+    except Exception as e:
+        print(f"Audio preprocessing failed, sending the original audio: {e}")
+        return _recognize_buffered(audio_content)
+    if processed is None: return None # nothing voiced: skip the billed recognition call entirely
+    if stats["speech_seconds"] > SYNC_RECOGNIZE_MAX_SECONDS and backend.supports_streaming:
+        return _recognize_streaming([processed])
+    return _recognize_buffered(processed)
+
+def _recognize_streaming(chunks):
+    """Feeds audio chunks to streaming_recognize as they arrive (split to the per-request size limit) and joins the final results."""
+    backend = speech_backends.get_backend()
+    streaming_config = speech.StreamingRecognitionConfig(config=backend.recognition_config("ogg_opus"))
+    requests_iter = (speech.StreamingRecognizeRequest(audio_content=chunk[i:i + STREAMING_REQUEST_MAX_BYTES]) for chunk in chunks for i in range(0, len(chunk), STREAMING_REQUEST_MAX_BYTES))
+    transcripts = []
+    for response in backend.client().streaming_recognize(config=streaming_config, requests=requests_iter):
+        for result in response.results:
+            if result.is_final and result.alternatives:
+                transcripts.append(result.alternatives[0].transcript.strip())
+    return " ".join(t for t in transcripts if t) or None
+
+def transcribe_telegram_voice_note(file_url, file_unique_id=None, streaming=True):
+    """
+    Downloads a Telegram audio file and transcribes it with the configured speech backend (Google Cloud
+    Speech-to-Text by default, or the offline engine with SPEECH_BACKEND=local).
+    Cached transcripts are returned without downloading when `file_unique_id` is known. By default the download
+    is piped into streaming recognition chunk by chunk, so transcription overlaps with the transfer and notes
+    longer than the synchronous recognize limit still work. If streaming fails on a short note, the chunks
+    received so far are retried with a single recognize call. With AUDIO_PREPROCESSING the note is downloaded
+    whole instead, trimmed of silence and re-encoded before upload. Buffered paths also look the audio up by
+    content hash before recognizing it.
+    """
+    try:
+        cached = get_cached_transcript(file_unique_id)
+        if cached is not None: return cached
+
+        # Download the audio file from Telegram's temporary URL
+        with _http_session.get(file_url, stream=True, timeout=30) as response:
+            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+            # Silence trimming and local (offline) backends need the whole file, so only the plain cloud path streams.
+            if not streaming or AUDIO_PREPROCESSING or not speech_backends.get_backend().supports_streaming:
+                audio_content = response.content
+                content_hash = hashlib.sha256(audio_content).hexdigest()
+                cached = transcript_cache.get(f"sha256:{content_hash}")
+                recognize = _recognize_preprocessed if AUDIO_PREPROCESSING else _recognize_buffered
+                transcript = cached.decode("utf-8") if cached is not None else recognize(audio_content)
+                _cache_transcript(transcript, file_unique_id, content_hash)
+                return transcript
 
-        # Return the most likely transcription
-        return response.results[0].alternatives[0].transcript
+            received = []
+            hasher = hashlib.sha256()
+            def downloaded_chunks():
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    if chunk:
+                        received.append(chunk); hasher.update(chunk)
+                        yield chunk
+            try:
+                transcript = _recognize_streaming(downloaded_chunks())
+            except Exception as e:
+                # `received` holds everything read so far; only read on if the body wasn't fully consumed.
+                try:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        received.append(chunk); hasher.update(chunk)
+                except requests.exceptions.StreamConsumedError:
+                    pass
+                audio_content = b"".join(received)
+                if len(audio_content) > SYNC_RECOGNIZE_MAX_BYTES: raise
+                print(f"Streaming transcription failed, retrying with recognize: {e}")
+                transcript = _recognize_buffered(audio_content)
+            _cache_transcript(transcript, file_unique_id, hasher.hexdigest())
+            return transcript
 
     except Exception as e:
         print(f"Error during transcription: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,68 @@
+# core/update_dedup.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class UpdateDeduplicator:
+    """
+    Remembers recently seen Telegram update_ids so redelivered or duplicated updates are dropped
+    before any transcription, LLM or Calendar work runs.
+    Entries live in a bounded in-memory LRU with a TTL. If `db_path` is given they are also written to
+    SQLite, so the cache survives restarts (and can be shared by several processes on one machine).
+    """
+
+    def __init__(self, max_size=10000, ttl_seconds=24 * 3600, db_path=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._seen = OrderedDict() # update_id -> first-seen unix timestamp
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"processed": 0, "duplicates_skipped": 0}
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_seen_updates_seen_at ON seen_updates (seen_at)")
+            self._db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (time.time() - ttl_seconds,))
+
+    def _expire(self, now):
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.ttl_seconds and len(self._seen) <= self.max_size: break
+            del self._seen[oldest_id]
+
+    def check_and_mark(self, update_id):
+        """Returns True if this update is new (and records it), False if it is a duplicate that should be skipped."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            seen_at = self._seen.get(update_id)
+            is_new = seen_at is None or now - seen_at > self.ttl_seconds
+            if is_new and self._db is not None:
+                # INSERT OR IGNORE is an atomic check-and-set, also across processes sharing the file.
+                self._db.execute("DELETE FROM seen_updates WHERE update_id = ? AND seen_at < ?", (update_id, now - self.ttl_seconds))
+                is_new = self._db.execute("INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, now)).rowcount == 1
+            if is_new:
+                self._seen[update_id] = now
+                self._seen.move_to_end(update_id)
+                self._expire(now)
+                self.stats["processed"] += 1
+            else:
+                self._seen.setdefault(update_id, now)
+                self.stats["duplicates_skipped"] += 1
+            return is_new
+
+    def forget(self, update_id):
+        """Un-marks an update, e.g. when it was rejected and Telegram is expected to redeliver it."""
+        with self._lock:
+            if self._seen.pop(update_id, None) is not None: self.stats["processed"] -= 1
+            if self._db is not None: self._db.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+    def prune(self):
+        """Deletes expired rows from the persistent store."""
+        if self._db is not None:
+            with self._lock: self._db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (time.time() - self.ttl_seconds,))
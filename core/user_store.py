@@ -0,0 +1,111 @@
+# core/user_store.py
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+USER_DB_PATH = os.environ.get("FOCUSFLOW_USER_DB", os.path.join("data", "users.db"))
+LEGACY_USERS_JSON = "telegram_users.json"
+
+class UserStore:
+    """
+    Small embedded user registry shared by the Streamlit app and the Telegram agent.
+    Users are indexed by chat_id and telegram_id. Reads are served from an in-memory cache that is
+    invalidated whenever another connection (e.g. the web app's onboarding form) commits a change,
+    which SQLite reports through `PRAGMA data_version` - so new users are visible without a restart.
+    """
+
+    def __init__(self, db_path=USER_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS users (
+            chat_id TEXT PRIMARY KEY,
+            telegram_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            timezone TEXT NOT NULL,
+            google_token_path TEXT NOT NULL,
+            updated_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users (telegram_id)")
+        self._cache = {} # chat_id -> profile dict, or None for a known miss
+        self._data_version = self._current_data_version()
+
+    def _current_data_version(self):
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _validate_cache(self):
+        version = self._current_data_version()
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    @staticmethod
+    def _to_profile(row):
+        return {"name": row["name"], "timezone": row["timezone"], "google_token_path": row["google_token_path"], "telegram_id": row["telegram_id"]}
+
+    def get_user(self, chat_id):
+        """Returns the profile dict for a chat_id, or None if the user hasn't registered."""
+        chat_id = str(chat_id)
+        with self._lock:
+            self._validate_cache()
+            if chat_id not in self._cache:
+                row = self._db.execute("SELECT * FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+                self._cache[chat_id] = self._to_profile(row) if row else None
+            return self._cache[chat_id]
+
+    def get_user_by_telegram_id(self, telegram_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM users WHERE telegram_id = ?", (str(telegram_id),)).fetchone()
+            return self._to_profile(row) if row else None
+
+    def upsert_user(self, chat_id, name, timezone, google_token_path, telegram_id=None):
+        """Registers or updates a user. Other processes pick up the change on their next read."""
+        chat_id = str(chat_id)
+        with self._lock:
+            self._db.execute(
+                """INSERT INTO users (chat_id, telegram_id, name, timezone, google_token_path, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET telegram_id = excluded.telegram_id, name = excluded.name,
+                timezone = excluded.timezone, google_token_path = excluded.google_token_path, updated_at = excluded.updated_at""",
+                (chat_id, str(telegram_id or chat_id), name, timezone, google_token_path, time.time()))
+            # Our own commits don't change data_version for this connection, so drop the entry explicitly.
+            self._cache.pop(chat_id, None)
+
+    def delete_user(self, chat_id):
+        with self._lock:
+            self._db.execute("DELETE FROM users WHERE chat_id = ?", (str(chat_id),))
+            self._cache.pop(str(chat_id), None)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def import_from_json(self, json_path=LEGACY_USERS_JSON):
+        """One-shot migration of the legacy telegram_users.json ({chat_id: profile}). Returns the number of users imported."""
+        with open(json_path, 'r') as f:
+            users = json.load(f)
+        now = time.time()
+        rows = [(str(chat_id), str(p.get("telegram_id", chat_id)), p["name"], p["timezone"], p["google_token_path"], now) for chat_id, p in users.items()]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO users (chat_id, telegram_id, name, timezone, google_token_path, updated_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+            self._cache.clear()
+        return len(rows)
+
+def open_user_store(db_path=USER_DB_PATH):
+    """Opens the user store, migrating telegram_users.json on first use if the store is still empty."""
+    store = UserStore(db_path)
+    if store.count() == 0 and os.path.exists(LEGACY_USERS_JSON):
+        imported = store.import_from_json(LEGACY_USERS_JSON)
+        print(f"Imported {imported} user(s) from {LEGACY_USERS_JSON} into {db_path}.")
+    return store
+
+if __name__ == "__main__":
+    # Usage: python -m core.user_store [path/to/telegram_users.json]
+    source = sys.argv[1] if len(sys.argv) > 1 else LEGACY_USERS_JSON
+    print(f"Imported {UserStore().import_from_json(source)} user(s) from {source} into {USER_DB_PATH}.")
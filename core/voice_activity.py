@@ -0,0 +1,67 @@
+# core/voice_activity.py
+import io
+
+import numpy as np
+
+from core import speech_backends
+
+FRAME_MS = 30
+PADDING_MS = 200 # speech kept on either side of every voiced frame, so pauses shrink to at most 2 * PADDING_MS
+MIN_SPEECH_DB = -50.0 # frames quieter than this (dBFS) are never speech
+NOISE_MARGIN_DB = 12.0 # a frame must be this much louder than the noise floor to count as speech
+
+def speech_mask(samples, sample_rate=speech_backends.SAMPLE_RATE, frame_ms=FRAME_MS):
+    """
+    Energy-based voice activity detection over non-overlapping frames, fully vectorized.
+    The noise floor is estimated from the quietest frames, so the threshold adapts to each recording.
+    Returns a boolean array with one entry per frame.
+    """
+    frame_len = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0: return np.zeros(0, dtype=bool)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms_db = 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-12)
+    noise_floor = np.percentile(rms_db, 10)
+    # If the clip is nearly all speech the "floor" is speech too; never demand more than 20 dB below the peak.
+    threshold = max(min(noise_floor + NOISE_MARGIN_DB, rms_db.max() - 20), MIN_SPEECH_DB)
+    return rms_db > threshold
+
+def trim_silence(samples, sample_rate=speech_backends.SAMPLE_RATE, frame_ms=FRAME_MS, padding_ms=PADDING_MS):
+    """Drops leading/trailing silence and shortens long pauses. Returns an empty array if nothing was voiced."""
+    voiced = speech_mask(samples, sample_rate, frame_ms)
+    if not voiced.any(): return samples[:0]
+    # Dilate the voiced frames by the padding so word onsets/endings and short pauses survive.
+    pad_frames = max(1, padding_ms // frame_ms)
+    keep = np.convolve(voiced.astype(np.int32), np.ones(2 * pad_frames + 1, dtype=np.int32), mode="same") > 0
+    frame_len = int(sample_rate * frame_ms / 1000)
+    keep_samples = np.repeat(keep, frame_len)
+    return samples[:keep_samples.size][keep_samples]
+
+def encode_opus(samples, sample_rate=speech_backends.SAMPLE_RATE, bitrate=24000):
+    """Re-encodes mono float32 PCM as a compact OGG/Opus file (what Speech-to-Text's OGG_OPUS encoding expects)."""
+    av = speech_backends.av
+    if av is None: raise RuntimeError("Encoding audio requires PyAV: pip install av")
+    buffer = io.BytesIO()
+    frame_size = sample_rate // 50 # 20 ms Opus frames
+    with av.open(buffer, mode="w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=sample_rate, layout="mono")
+        stream.bit_rate = bitrate
+        for start in range(0, samples.size, frame_size):
+            frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(samples[start:start + frame_size]).reshape(1, -1), format="flt", layout="mono")
+            frame.sample_rate = sample_rate
+            for packet in stream.encode(frame): container.mux(packet)
+        for packet in stream.encode(None): container.mux(packet)
+    return buffer.getvalue()
+
+def preprocess_voice_note(audio_bytes):
+    """
+    Decodes a voice note, cuts silence and re-encodes it as 16 kHz mono Opus before upload.
+    Returns (audio_bytes_or_None, stats); None means no speech was found and recognition can be skipped.
+    """
+    samples = speech_backends.decode_audio(audio_bytes)
+    trimmed = trim_silence(samples)
+    stats = {"input_bytes": len(audio_bytes), "input_seconds": samples.size / speech_backends.SAMPLE_RATE, "speech_seconds": trimmed.size / speech_backends.SAMPLE_RATE}
+    if trimmed.size == 0: return None, stats
+    encoded = encode_opus(trimmed)
+    stats["output_bytes"] = len(encoded)
+    return encoded, stats
@@ -1,9 +1,7 @@
 # pages/1_🗓️_Timetable_Manager.py
 import streamlit as st
-import pandas as pd
-import json
 import os
-from datetime import datetime, timedelta, time
+from datetime import date, datetime, timedelta, time
 
 # Import utilities from the main app directory
 import sys
@@ -20,45 +18,53 @@ if 'calendar_service' not in st.session_state or st.session_state.calendar_servi
     st.link_button("Go to Login Page", "/")
     st.stop()
     
-st.write("Upload an image of your class schedule, and I'll help you digitize it!")
+st.write("Upload images or PDFs of your class schedule, and I'll help you digitize it!")
 
 # Initialize session state for the timetable DataFrame
 if 'timetable_df' not in st.session_state:
     st.session_state.timetable_df = None
 
-uploaded_file = st.file_uploader(
-    "Choose a timetable image...", type=["jpg", "jpeg", "png"]
+uploaded_files = st.file_uploader(
+    "Choose timetable images or PDFs...", type=["jpg", "jpeg", "png", "pdf"], accept_multiple_files=True
 )
 
-if uploaded_file is not None:
-    image_bytes = uploaded_file.getvalue()
-    st.image(image_bytes, caption="Your Uploaded Timetable", width=400)
-
-    if st.button("Extract Schedule from Image", type="primary"):
-        with st.spinner("Analyzing your timetable with AI... This might take a moment."):
-            raw_response = timetable_parser.parse_timetable_image(image_bytes)
-            if raw_response:
-                try:
-                    cleaned_response = raw_response.strip().replace("```json", "").replace("```", "")
-                    data = json.loads(cleaned_response)
-                    
-                    if 'schedule' in data and data['schedule']:
-                        df = pd.DataFrame(data['schedule'])
-                        required_cols = ['day', 'subject', 'start_time', 'end_time']
-                        if all(col in df.columns for col in required_cols):
-                            st.session_state.timetable_df = df
-                            st.success("Successfully extracted your schedule! You can now edit any details below before adding to your calendar.")
-                        else:
-                            st.error("The AI response was missing some required columns. Please try again.")
-                            st.code(df.to_string())
-                    else:
-                        st.error("The AI could not find a valid schedule in the image.")
-                        st.code(raw_response)
-                except (json.JSONDecodeError, KeyError) as e:
-                    st.error(f"Could not parse the AI's response: {e}")
-                    st.code(raw_response)
-            else:
-                st.error("Failed to get a response from the AI.")
+if uploaded_files:
+    photos = [f.getvalue() for f in uploaded_files if not f.name.lower().endswith(".pdf")]
+    if photos: st.image(photos, caption=[f.name for f in uploaded_files if not f.name.lower().endswith(".pdf")], width=200)
+    for f in uploaded_files:
+        if f.name.lower().endswith(".pdf"): st.caption(f"📄 {f.name}")
+
+    if st.button("Extract Schedule", type="primary"):
+        page_images = []
+        for f in uploaded_files:
+            try:
+                page_images.extend(timetable_parser.rasterize_upload(f.getvalue(), f.name))
+            except Exception as e:
+                st.error(f"Could not read '{f.name}': {e}")
+
+        # Pages are parsed in parallel; rows are shown as soon as each one is complete, whichever page it came from.
+        live_table = st.empty()
+        rows, failed_pages = [], []
+        with st.spinner(f"Analyzing {len(page_images)} page(s) with AI... This might take a moment."):
+            for page_index, batch, error in timetable_parser.stream_timetable_pages(page_images):
+                if error is not None: failed_pages.append((page_index, error))
+                if not batch: continue
+                rows.extend(batch)
+                live_table.dataframe(timetable_parser.deduplicate_schedule(timetable_parser.validate_schedule(rows)[0]), use_container_width=True)
+        live_table.empty()
+        for page_index, error in sorted(failed_pages, key=lambda item: item[0]):
+            st.error(f"Could not parse page {page_index + 1}: {error}")
+
+        df, rejected = timetable_parser.validate_schedule(rows)
+        df = timetable_parser.deduplicate_schedule(df)
+        if not df.empty:
+            st.session_state.timetable_df = df
+            st.success("Successfully extracted your schedule! You can now edit any details below before adding to your calendar.")
+        elif not rows:
+            st.error("The AI could not find a valid schedule in the upload.")
+        if not rejected.empty:
+            st.warning(f"{len(rejected)} extracted row(s) failed validation and were left out. Add them below by hand if needed.")
+            st.dataframe(rejected, use_container_width=True)
 
 if st.session_state.timetable_df is not None:
     st.subheader("Extracted & Editable Schedule")
@@ -77,6 +83,24 @@ if st.session_state.timetable_df is not None:
     
     st.session_state.timetable_df = edited_df
 
+    # Semester mode: one weekly recurring event per class instead of a single occurrence next week.
+    semester_mode = st.toggle("Repeat every week for the whole semester", value=False)
+    holidays = set()
+    if semester_mode:
+        col1, col2 = st.columns(2)
+        semester_start = col1.date_input("Semester starts", value=date.today())
+        semester_end = col2.date_input("Semester ends", value=date.today() + timedelta(weeks=15))
+        holidays_text = st.text_area("Holidays (no classes)", placeholder="One date or range per line, e.g.\n2026-11-26\n2026-12-21..2027-01-03")
+        for line in holidays_text.splitlines():
+            try:
+                first, _, last = line.strip().partition("..")
+                if not first: continue
+                first_day = date.fromisoformat(first.strip())
+                last_day = date.fromisoformat(last.strip()) if last else first_day
+                holidays.update(first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1))
+            except ValueError:
+                st.warning(f"Ignoring holiday line '{line.strip()}': use YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD.")
+
     if st.button("Add Edited Schedule to Google Calendar", type="primary"):
         df = st.session_state.timetable_df
         
@@ -84,62 +108,49 @@ if st.session_state.timetable_df is not None:
             st.error("Your schedule is empty or has missing values. Please fill in all fields.")
             st.stop()
             
-        total_events = len(df)
         progress_bar = st.progress(0, text="Starting to add events...")
-        
+
         with st.spinner("Adding events to your calendar..."):
             day_map = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3, "Friday": 4, "Saturday": 5, "Sunday": 6}
-            today = datetime.now()
-            
+            today = datetime.combine(semester_start, time.min) if semester_mode else datetime.now()
+
             service = st.session_state.calendar_service
             user_tz = st.session_state.user_profile['timezone']
-            
-            for index, row in df.iterrows():
-                try:
-                    day_name = str(row['day']).strip().capitalize()
-                    days_ahead = day_map[day_name] - today.weekday()
-                    if days_ahead < 0: days_ahead += 7
-                    event_date = today + timedelta(days=days_ahead)
-                    
-                    # --- FIX: Robustly handle time data from st.data_editor ---
-                    # It might be a string ("16:00") or a datetime.time object.
-                    # We format it consistently to HH:MM.
-                    start_time_obj = row['start_time']
-                    end_time_obj = row['end_time']
-                    
-                    if isinstance(start_time_obj, time):
-                        start_time_formatted = start_time_obj.strftime("%H:%M")
-                    else:
-                        start_time_formatted = str(start_time_obj)
-
-                    if isinstance(end_time_obj, time):
-                        end_time_formatted = end_time_obj.strftime("%H:%M")
-                    else:
-                        end_time_formatted = str(end_time_obj)
-
-                    # Create the final naive timestamp strings
-                    start_datetime_str = f"{event_date.strftime('%Y-%m-%d')}T{start_time_formatted}:00"
-                    end_datetime_str = f"{event_date.strftime('%Y-%m-%d')}T{end_time_formatted}:00"
-
-                    # --- FIX: Use the correct parameter names for the function call ---
-                    result = calendar_utils.add_event(
-                        service=service,
-                        user_timezone_str=user_tz,
-                        summary=str(row['subject']),
-                        start_time_str=start_datetime_str,
-                        end_time_str=end_datetime_str, # Corrected parameter name
-                        description=f"Class from timetable - {day_name}"
-                    )
-                    
-                    if result.startswith("✅"):
-                        st.success(f"Added '{row['subject']}'")
-                    else:
-                        st.error(f"Failed to add '{row['subject']}': {result}")
-
-                except Exception as e:
-                    st.error(f"Failed to process row for '{row.get('subject', 'Unknown')}': {e}")
-                
-                progress_bar.progress((index + 1) / total_events)
+
+            events, subjects = [], []
+            for _, row in df.iterrows():
+                day_name = str(row['day']).strip().capitalize()
+                if day_name not in day_map:
+                    st.error(f"Failed to process row for '{row.get('subject', 'Unknown')}': unknown day '{row['day']}'")
+                    continue
+                days_ahead = day_map[day_name] - today.weekday()
+                if days_ahead < 0: days_ahead += 7
+                event_date = today + timedelta(days=days_ahead)
+
+                # st.data_editor may hand back a string ("16:00") or a datetime.time; format both as HH:MM.
+                start_time_formatted = row['start_time'].strftime("%H:%M") if isinstance(row['start_time'], time) else str(row['start_time'])
+                end_time_formatted = row['end_time'].strftime("%H:%M") if isinstance(row['end_time'], time) else str(row['end_time'])
+
+                event = {
+                    "summary": str(row['subject']),
+                    "start_time_str": f"{event_date.strftime('%Y-%m-%d')}T{start_time_formatted}:00",
+                    "end_time_str": f"{event_date.strftime('%Y-%m-%d')}T{end_time_formatted}:00",
+                    "description": f"Class from timetable - {day_name}",
+                }
+                if semester_mode: event.update(recurrence_until=semester_end, exdates=holidays)
+                events.append(event)
+                subjects.append(str(row['subject']))
+
+            # One conflict query plus one batch request per 50 classes, instead of two round trips per row.
+            results = calendar_utils.add_events_bulk(
+                service, user_tz, events,
+                on_progress=lambda done, total: progress_bar.progress(done / total, text=f"Added {done} of {total} events..."),
+            )
+
+        added = [subject for subject, result in zip(subjects, results) if result.startswith("✅")]
+        if added: st.success(f"Added {len(added)} event(s): " + ", ".join(added))
+        for subject, result in zip(subjects, results):
+            if not result.startswith("✅"): st.error(f"Failed to add '{subject}': {result}")
 
         st.success("Timetable processing complete!")
-        st.balloons()
\ No newline at end of file
+        st.balloons()
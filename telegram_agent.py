@@ -1,15 +1,22 @@
 # telegram_agent.py
 import os
 import json
+import signal
+import argparse
 import asyncio
-from quart import Quart, request
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, request, jsonify
 import telegram
 import google.generativeai as genai
-import pytz
-from datetime import datetime
 import toml
 
-from core import calendar_utils, transcriber
+from core import calendar_utils, transcriber, user_store
+from core.agent_queue import ChatJobQueue
+from core.update_dedup import UpdateDeduplicator
+from core.agent_sessions import ChatSessionCache
+from core.agent_outbox import TelegramOutbox
+from core.agent_inbox import SharedInbox
 
 # --- ROBUST SECRET LOADING ---
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
@@ -25,93 +32,238 @@ if not GOOGLE_API_KEY or not TELEGRAM_BOT_TOKEN: raise ValueError("API keys are
 # --- INITIALIZATION ---
 app = Quart(__name__)
 genai.configure(api_key=GOOGLE_API_KEY)
-bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
-try:
-    with open('telegram_users.json', 'r') as f:
-        users_db = json.load(f)
-except FileNotFoundError: users_db = {}
+# TELEGRAM_API_BASE_URL lets the agent talk to a local Bot API server (or a fake one in tests), e.g. "http://127.0.0.1:8081".
+TELEGRAM_API_BASE_URL = os.environ.get("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+bot = telegram.Bot(token=TELEGRAM_BOT_TOKEN, base_url=f"{TELEGRAM_API_BASE_URL}/bot", base_file_url=f"{TELEGRAM_API_BASE_URL}/file/bot")
+users_db = user_store.open_user_store() # SQLite-backed; users registered in the web app show up without a restart
+
+# --- BLOCKING I/O OFFLOADING ---
+# The Calendar (httplib2) and Speech/download clients are synchronous. Each dependency gets its own
+# bounded thread pool so a slow voice note can neither stall the event loop nor starve calendar calls.
+IO_CONCURRENCY = {
+    "calendar": int(os.environ.get("AGENT_CALENDAR_CONCURRENCY", 16)),
+    "speech": int(os.environ.get("AGENT_SPEECH_CONCURRENCY", 4)),
+    "inbox": 1, # SQLite inbox access in production mode
+}
+_io_executors = {name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"{name}-io") for name, limit in IO_CONCURRENCY.items()}
+
+async def run_blocking(dependency, func, *args, **kwargs):
+    """Runs a blocking call on the thread pool reserved for `dependency` without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executors[dependency], functools.partial(func, *args, **kwargs))
+
+# --- PRODUCTION MODE ---
+# Set by `python telegram_agent.py --serve --workers N`. Every ASGI worker process stores incoming updates in a
+# shared SQLite inbox and processes only the chats of its own partition, so ordering and caches stay per chat.
+PRODUCTION_MODE = os.environ.get("AGENT_PRODUCTION") == "1"
+AGENT_PARTITIONS = int(os.environ.get("AGENT_PARTITIONS", 1))
+AGENT_INBOX_DB = os.environ.get("AGENT_INBOX_DB", os.path.join("data", "inbox.db"))
+inbox = SharedInbox(AGENT_INBOX_DB, AGENT_PARTITIONS) if PRODUCTION_MODE else None
+_draining = False
+
+# --- JOB QUEUE ---
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", 8))
+AGENT_MAX_PENDING = int(os.environ.get("AGENT_MAX_PENDING", 1000))
+AGENT_SHUTDOWN_TIMEOUT = int(os.environ.get("AGENT_SHUTDOWN_TIMEOUT", 30))
+
+# --- OUTBOUND MESSAGES ---
+# All replies go through one rate-limited queue (global + per-chat token buckets, RetryAfter handling).
+outbox = TelegramOutbox(
+    bot,
+    global_rate=float(os.environ.get("AGENT_SEND_GLOBAL_RATE", 25)),
+    per_chat_rate=float(os.environ.get("AGENT_SEND_PER_CHAT_RATE", 1)),
+)
+
+# --- DUPLICATE UPDATE FILTER ---
+# Set AGENT_DEDUP_DB to a file path (e.g. "data/seen_updates.db") to keep seen update_ids across restarts.
+update_dedup = UpdateDeduplicator(
+    max_size=int(os.environ.get("AGENT_DEDUP_MAX_SIZE", 10000)),
+    ttl_seconds=int(os.environ.get("AGENT_DEDUP_TTL_SECONDS", 24 * 3600)),
+    # Production workers must share the filter, so it is always persisted there.
+    db_path=os.environ.get("AGENT_DEDUP_DB") or (os.path.join("data", "seen_updates.db") if PRODUCTION_MODE else None),
+)
 
 # --- EXPLICIT TOOL DEFINITION ---
 add_event_tool = genai.protos.FunctionDeclaration(name="add_event", description="Adds an event to the calendar.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"summary": genai.protos.Schema(type=genai.protos.Type.STRING), "start_time_str": genai.protos.Schema(type=genai.protos.Type.STRING), "end_time_str": genai.protos.Schema(type=genai.protos.Type.STRING)}, required=["summary", "start_time_str", "end_time_str"]))
-get_events_tool = genai.protos.FunctionDeclaration(name="get_events", description="Fetches events for a specific date.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="The date in YYYY-MM-DD format. If omitted, today's date will be used.")}))
-tools = genai.protos.Tool(function_declarations=[add_event_tool, get_events_tool])
+get_events_tool = genai.protos.FunctionDeclaration(name="get_events", description="Fetches events for a specific date, or for every day of a date range (e.g. 'this week') in one call.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="The date in YYYY-MM-DD format. If omitted, today's date will be used."), "end_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="Optional last day of a range (inclusive), YYYY-MM-DD, at most 31 days after date_str.")}))
+find_free_slots_tool = genai.protos.FunctionDeclaration(name="find_free_slots", description="Finds free time slots of a given length in the calendar over a date range, within working hours.", parameters=genai.protos.Schema(type=genai.protos.Type.OBJECT, properties={"duration_minutes": genai.protos.Schema(type=genai.protos.Type.NUMBER, description="Minimum length of each free slot in minutes."), "start_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="First day to search, YYYY-MM-DD. Defaults to today."), "end_date_str": genai.protos.Schema(type=genai.protos.Type.STRING, description="Last day to search (inclusive), YYYY-MM-DD. Defaults to 6 days after the start."), "work_start_time": genai.protos.Schema(type=genai.protos.Type.STRING, description="Earliest time of day, HH:MM. Defaults to 09:00."), "work_end_time": genai.protos.Schema(type=genai.protos.Type.STRING, description="Latest time of day, HH:MM. Defaults to 18:00."), "buffer_minutes": genai.protos.Schema(type=genai.protos.Type.NUMBER, description="Minutes to keep free before and after existing events.")}, required=["duration_minutes"]))
+tools = genai.protos.Tool(function_declarations=[add_event_tool, get_events_tool, find_free_slots_tool])
 
-# --- THE MAIN ASYNC TELEGRAM WEBHOOK ---
-@app.route(f'/{TELEGRAM_BOT_TOKEN}', methods=['POST'])
-async def respond():
-    data = await request.get_json(force=True)
-    update = telegram.Update.de_json(data, bot)
-    if not update.message: return 'ok'
-    
+# --- PER-CHAT GEMINI SESSIONS ---
+def build_agent_model(user_tz_str, date_str):
+    """Builds the agent model for one timezone and local date; shared by every chat in that timezone."""
+    SYSTEM_PROMPT = f"You are a function-calling AI model. User's timezone is {user_tz_str}. Current date is {date_str}. Your job is to convert requests into function calls. For scheduling, call `add_event` with timezone-NAIVE time strings (YYYY-MM-DDTHH:MM:SS). For viewing events, call `get_events`, inferring the date_str if the user specifies 'tomorrow' or another date. For several days (e.g. 'this week'), make a single `get_events` call with date_str and end_date_str. To find free time (e.g. 'find me 2 free hours this week'), call `find_free_slots` with the duration and date range. You may call several functions at once when a request involves multiple actions. When function results come back, reply with a short summary that keeps their details. Use the earlier conversation to resolve follow-ups like 'make it 5pm instead'."
+    return genai.GenerativeModel(model_name="gemini-1.5-flash-latest", tools=[tools], system_instruction=SYSTEM_PROMPT)
+
+chat_sessions = ChatSessionCache(
+    build_agent_model,
+    max_sessions=int(os.environ.get("AGENT_MAX_SESSIONS", 1000)),
+    idle_seconds=int(os.environ.get("AGENT_SESSION_IDLE_SECONDS", 3600)),
+    max_turns=int(os.environ.get("AGENT_SESSION_MAX_TURNS", 10)),
+)
+
+# --- TOOL EXECUTION ---
+async def execute_tool_call(service, user_tz_str, function_call):
+    """Executes one Gemini function call against the user's calendar and returns the result text."""
+    tool_functions = {'add_event': calendar_utils.add_event, 'get_events': calendar_utils.get_events, 'find_free_slots': calendar_utils.find_free_slots}
+    tool_function = tool_functions.get(function_call.name)
+    if not tool_function: return "I tried to use a function that doesn't exist."
+    return await run_blocking("calendar", tool_function, service=service, user_timezone_str=user_tz_str, **dict(function_call.args))
+
+# --- UPDATE PROCESSING (runs on the job queue workers) ---
+async def process_update(update):
+    """Transcribes, interprets and executes a single Telegram update, replying in the chat."""
     chat_id = str(update.message.chat.id)
-    user_profile = users_db.get(chat_id)
+    user_profile = users_db.get_user(chat_id)
     if not user_profile:
-        await bot.send_message(chat_id=chat_id, text="Hello! Your Telegram account isn't recognized. Please register in the FocusFlow web app first.")
-        return 'ok'
+        outbox.send(chat_id, "Hello! Your Telegram account isn't recognized. Please register in the FocusFlow web app first.")
+        return
 
     user_prompt = ""
     if update.message.voice:
-        await bot.send_message(chat_id=chat_id, text="🎙️ Got it! Let me listen...")
-        file_info = await bot.get_file(update.message.voice.file_id)
-        user_prompt = transcriber.transcribe_telegram_voice_note(file_info.file_path)
+        voice = update.message.voice
+        # Forwarded or retried notes are answered from the transcript cache without touching Telegram or Speech.
+        user_prompt = await run_blocking("speech", transcriber.get_cached_transcript, voice.file_unique_id)
+        if user_prompt is None:
+            outbox.send(chat_id, "🎙️ Got it! Let me listen...")
+            file_info = await bot.get_file(voice.file_id)
+            user_prompt = await run_blocking("speech", transcriber.transcribe_telegram_voice_note, file_info.file_path, file_unique_id=voice.file_unique_id)
     elif update.message.text:
         user_prompt = update.message.text
     
     if not user_prompt:
-        await bot.send_message(chat_id=chat_id, text="Sorry, I couldn't understand that.")
-        return 'ok'
+        outbox.send(chat_id, "Sorry, I couldn't understand that.")
+        return
     
     # --- CORE AGENT LOGIC ---
     try:
-        service = calendar_utils.get_calendar_service_for_agent(user_profile['google_token_path'])
+        service = await run_blocking("calendar", calendar_utils.get_pooled_calendar_service, chat_id, user_profile['google_token_path'])
         if not service: raise Exception("Could not authenticate with Google Calendar.")
         
         user_tz_str = user_profile['timezone']
-        SYSTEM_PROMPT = f"You are a function-calling AI model. User's timezone is {user_tz_str}. Current date is {datetime.now(pytz.timezone(user_tz_str)).strftime('%Y-%m-%d')}. Your job is to convert requests into function calls. For scheduling, call `add_event` with timezone-NAIVE time strings (YYYY-MM-DDTHH:MM:SS). For viewing events, call `get_events`, inferring the date_str if the user specifies 'tomorrow' or another date."
-        
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash-latest", tools=[tools], system_instruction=SYSTEM_PROMPT)
-        chat = model.start_chat()
+        chat = chat_sessions.get(chat_id, user_tz_str)
 
         ai_response = await chat.send_message_async(user_prompt)
-        part = ai_response.parts[0]
-        
+        function_calls = [part.function_call for part in ai_response.parts if part.function_call]
+
         final_message = ""
-        if part.function_call:
-            tool_name = part.function_call.name
-            args = dict(part.function_call.args)
-            
-            # --- THE DEFINITIVE FIX ---
-            # Correctly pass all necessary context (service, user_timezone_str) to BOTH functions.
-            if tool_name == 'add_event':
-                # Pass the timezone string with the correct parameter name
-                final_message = calendar_utils.add_event(
-                    service=service, 
-                    user_timezone_str=user_tz_str,  # Correct parameter name
-                    **args
-                )
-            elif tool_name == 'get_events':
-                final_message = calendar_utils.get_events(
-                    service=service, 
-                    user_timezone_str=user_tz_str,  # Correct parameter name
-                    **args
-                )
-            else:
-                final_message = "I tried to use a function that doesn't exist."
-
-        elif part.text:
-            final_message = part.text
-        
-        await bot.send_message(chat_id=chat_id, text=final_message or "I'm not sure how to respond to that.")
+        if function_calls:
+            # Reads run concurrently, but add_event calls run one after another so each one's conflict check sees
+            # the events added before it. All results go back to the model in one round trip.
+            async def run_writes():
+                return [await execute_tool_call(service, user_tz_str, function_call) for function_call in function_calls if function_call.name == 'add_event']
+            read_results, write_results = await asyncio.gather(
+                asyncio.gather(*(execute_tool_call(service, user_tz_str, function_call) for function_call in function_calls if function_call.name != 'add_event')),
+                run_writes())
+            reads, writes = iter(read_results), iter(write_results)
+            tool_results = [next(writes) if function_call.name == 'add_event' else next(reads) for function_call in function_calls]
+            ai_response = await chat.send_message_async([
+                genai.protos.Part(function_response=genai.protos.FunctionResponse(name=function_call.name, response={"result": result}))
+                for function_call, result in zip(function_calls, tool_results)
+            ])
+            final_message = "".join(part.text for part in ai_response.parts if part.text) or "\n\n".join(tool_results)
+        else:
+            final_message = "".join(part.text for part in ai_response.parts if part.text)
+
+        chat_sessions.trim(chat_id)
+        outbox.send(chat_id, final_message or "I'm not sure how to respond to that.")
 
     except Exception as e:
+        chat_sessions.reset(chat_id)
         if "MALFORMED_FUNCTION_CALL" in str(e):
-             await bot.send_message(chat_id=chat_id, text="I'm missing some information. For an event, I need a title, start time, and end time.")
+             outbox.send(chat_id, "I'm missing some information. For an event, I need a title, start time, and end time.")
         else:
             print(f"Error processing command: {e}")
-            await bot.send_message(chat_id=chat_id, text="Sorry, I encountered an internal error.")
+            outbox.send(chat_id, "Sorry, I encountered an internal error.")
+
+async def process_queued_update(update):
+    try:
+        await process_update(update)
+    finally:
+        if inbox: await run_blocking("inbox", inbox.done, update.update_id)
+
+job_queue = ChatJobQueue(process_queued_update, max_workers=AGENT_WORKERS, max_pending=AGENT_MAX_PENDING)
 
+def enqueue_update(update):
+    """Hands an update to the job queue (or the shared inbox in production). Returns False only if it should be redelivered later."""
+    if not update.message: return True
+    # Retries and duplicate deliveries are dropped here, before any expensive work is queued.
+    if not update_dedup.check_and_mark(update.update_id): return True
+    try:
+        if inbox:
+            accepted = inbox.backlog() < AGENT_MAX_PENDING * AGENT_PARTITIONS
+            if accepted: inbox.put(update.update_id, update.message.chat.id, update.to_json())
+        else:
+            accepted = job_queue.submit(str(update.message.chat.id), update)
+    except Exception as e:
+        # e.g. "database is locked" on the shared inbox: treat it like backpressure so the update is redelivered.
+        print(f"Could not enqueue update {update.update_id}: {e}")
+        accepted = False
+    # Unmark rejected updates, otherwise the redelivery would be dropped as a duplicate.
+    if not accepted: update_dedup.forget(update.update_id)
+    return accepted
+
+async def pump_inbox():
+    """Production mode: moves this worker's partition of the shared inbox onto the local job queue, oldest first."""
+    while True:
+        if job_queue.pending >= AGENT_MAX_PENDING // 2:
+            await asyncio.sleep(0.1); continue
+        rows = await run_blocking("inbox", inbox.claim, 100)
+        for index, (update_id, payload) in enumerate(rows):
+            update = telegram.Update.de_json(json.loads(payload), bot)
+            if not job_queue.submit(str(update.message.chat.id), update):
+                # Local queue is full; put the rest back so they are claimed again in order.
+                await run_blocking("inbox", inbox.unclaim, [row[0] for row in rows[index:]])
+                break
+        if not rows: await asyncio.sleep(0.05)
+
+# --- THE MAIN ASYNC TELEGRAM WEBHOOK ---
+# The webhook only validates and enqueues the update, then acknowledges immediately so Telegram never
+# retries a delivery because transcription, Gemini or Calendar calls were slow.
+@app.route(f'/{TELEGRAM_BOT_TOKEN}', methods=['POST'])
+async def respond():
+    data = await request.get_json(force=True)
+    update = telegram.Update.de_json(data, bot)
+    if not enqueue_update(update):
+        # Backpressure: a non-2xx response makes Telegram redeliver this update later.
+        return 'busy', 503
     return 'ok'
 
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    health = {"status": "draining" if _draining else "ok", "pid": os.getpid(), "partition": inbox.partition if inbox else None, "pending_jobs": job_queue.pending}
+    return jsonify(health), 503 if _draining else 200
+
+@app.route('/stats', methods=['GET'])
+async def stats():
+    return jsonify({"dedup": update_dedup.stats, "queue": {**job_queue.stats, "pending": job_queue.pending}, "outbox": outbox.stats, "transcripts": transcriber.cache_stats()})
+
+_inbox_pump = None
+
+@app.before_serving
+async def start_job_queue():
+    global _inbox_pump
+    outbox.start()
+    job_queue.start()
+    if inbox:
+        partition = await asyncio.to_thread(inbox.claim_partition)
+        print(f"Worker {os.getpid()} owns chat partition {partition}/{AGENT_PARTITIONS}.")
+        _inbox_pump = asyncio.create_task(pump_inbox())
+
+@app.after_serving
+async def drain_job_queue():
+    # Graceful shutdown: stop taking new work, finish what is in flight, flush replies.
+    global _draining
+    _draining = True
+    if _inbox_pump:
+        _inbox_pump.cancel()
+        await asyncio.gather(_inbox_pump, return_exceptions=True)
+    await job_queue.drain(timeout=AGENT_SHUTDOWN_TIMEOUT)
+    if inbox: inbox.release_partition()
+    await outbox.drain(timeout=AGENT_SHUTDOWN_TIMEOUT)
+    update_dedup.prune()
+    for executor in _io_executors.values(): executor.shutdown(wait=False)
+
 @app.route('/set_webhook', methods=['GET'])
 async def set_webhook():
     webhook_url = os.environ.get("TELEGRAM_WEBHOOK_URL")
@@ -121,8 +273,92 @@ async def set_webhook():
         return f"webhook setup ok to {webhook_url_with_token}"
     return "No webhook URL provided."
 
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5003))
+# --- LONG-POLLING MODE (no public URL / ngrok needed) ---
+POLL_OFFSET_FILE = os.environ.get("AGENT_POLL_OFFSET_FILE", os.path.join("data", "poll_offset.json"))
+POLL_TIMEOUT_SECONDS = int(os.environ.get("AGENT_POLL_TIMEOUT", 30))
+POLL_BATCH_SIZE = int(os.environ.get("AGENT_POLL_BATCH_SIZE", 100))
+
+def _load_poll_offset():
     try:
-        app.run(port=port, debug=True)
-    except KeyboardInterrupt: pass
\ No newline at end of file
+        with open(POLL_OFFSET_FILE, 'r') as f: return json.load(f).get("offset")
+    except (FileNotFoundError, ValueError): return None
+
+def _save_poll_offset(offset):
+    # Write-then-rename so a crash never leaves a half-written checkpoint behind.
+    os.makedirs(os.path.dirname(POLL_OFFSET_FILE) or ".", exist_ok=True)
+    tmp_path = f"{POLL_OFFSET_FILE}.tmp"
+    with open(tmp_path, 'w') as f: json.dump({"offset": offset}, f)
+    os.replace(tmp_path, POLL_OFFSET_FILE)
+
+async def run_polling():
+    """
+    Pulls updates with getUpdates in batches and fans them out to the same job queue the webhook uses.
+    The offset is checkpointed after every batch once its updates are queued (not processed), so a restart
+    resumes where it left off and delivery is at-most-once: a clean shutdown drains the queue first, but a crash
+    loses updates that were queued and not yet handled. The dedup filter is in memory unless AGENT_DEDUP_DB is set.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try: loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: pass # Windows
+
+    async with bot:
+        # getUpdates is refused while a webhook is set.
+        await bot.delete_webhook(drop_pending_updates=False)
+        await start_job_queue()
+        offset = _load_poll_offset()
+        backoff = 1
+        print(f"Long-polling for updates (offset={offset})...")
+        try:
+            while not stop.is_set():
+                poll = asyncio.ensure_future(bot.get_updates(offset=offset, limit=POLL_BATCH_SIZE, timeout=POLL_TIMEOUT_SECONDS, allowed_updates=["message"]))
+                stopped = asyncio.ensure_future(stop.wait())
+                await asyncio.wait({poll, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                if stop.is_set():
+                    poll.cancel()
+                    break
+                try:
+                    updates = poll.result()
+                    backoff = 1
+                except telegram.error.NetworkError as e:
+                    print(f"getUpdates failed, retrying in {backoff}s: {e}")
+                    await asyncio.sleep(backoff); backoff = min(backoff * 2, 60)
+                    continue
+
+                for update in updates:
+                    if not enqueue_update(update):
+                        # Queue is full: stop here and fetch this update again on the next poll.
+                        await asyncio.sleep(1)
+                        break
+                    offset = update.update_id + 1
+                if updates: _save_poll_offset(offset)
+        finally:
+            await drain_job_queue()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FocusFlow Telegram agent")
+    parser.add_argument("--poll", action="store_true", help="Use getUpdates long polling instead of serving a webhook.")
+    parser.add_argument("--serve", action="store_true", help="Serve the webhook with Hypercorn and several worker processes.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)), help="Number of worker processes for --serve.")
+    args = parser.parse_args()
+    if args.poll or os.environ.get("AGENT_MODE") == "poll":
+        asyncio.run(run_polling())
+    elif args.serve:
+        from hypercorn.config import Config
+        from hypercorn.run import run as run_hypercorn
+        # Worker processes re-import this module; these variables switch them into production mode.
+        os.environ["AGENT_PRODUCTION"] = "1"
+        os.environ["AGENT_PARTITIONS"] = str(args.workers)
+        config = Config()
+        config.application_path = "telegram_agent:app"
+        config.bind = [f"0.0.0.0:{int(os.environ.get('PORT', 5003))}"]
+        config.workers = args.workers
+        config.graceful_timeout = AGENT_SHUTDOWN_TIMEOUT
+        run_hypercorn(config)
+    else:
+        port = int(os.environ.get('PORT', 5003))
+        try:
+            app.run(port=port, debug=True)
+        except KeyboardInterrupt: pass